@@ -0,0 +1,120 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
+Last Update: 2026/10/17
+Description: Measures startup time of all mjt_* console scripts
+
+# Usage:
+$ python benchmarks/startup.py [--runs N] [script] [script ...]
+
+# Notes:
+* Each script is started with "--help", so that it imports everything it
+  needs, but does not talk to MaaS or any BMC.
+* "python" is the time needed to start the interpreter, for reference.
+* Scripts that fail to start are reported with the last line of their
+  error output, and the benchmark exits with a non-zero status.
+"""
+
+import argparse
+import configparser
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SETUP_CFG = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'setup.cfg')
+
+RUN_SCRIPT = '''
+import sys
+from {module} import {func}
+sys.argv = ['{name}', '--help']
+{func}()
+'''
+
+
+def entry_points():
+    """returns a {'script_name': 'module:function'} dict from setup.cfg"""
+    config = configparser.ConfigParser()
+    config.read(SETUP_CFG)
+
+    result = {}
+    for line in config['entry_points']['console_scripts'].splitlines():
+        if '=' in line:
+            name, target = line.split('=')
+            result[name.strip()] = target.strip()
+
+    return result
+
+
+def measure(code, runs):
+    """runs `python -c @code` @runs times. Returns a `(durations, error)`
+    tuple, with durations in ms. If a run fails, `error` is its stderr and
+    no more runs are made"""
+    durations = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-c', code], stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE, universal_newlines=True)
+        if result.returncode != 0:
+            return durations, result.stderr.strip() or (
+                'exited with code {}'.format(result.returncode))
+
+        durations.append((time.perf_counter() - started) * 1000)
+
+    return durations, None
+
+
+def main():
+    """parses arguments and does work"""
+    parser = argparse.ArgumentParser(
+        description='Measure startup time of mjt_* scripts')
+    parser.add_argument('scripts', type=str, nargs='*',
+                        help='Scripts to measure (default: all)')
+    parser.add_argument('--runs', type=int, default=10,
+                        help='Number of runs per script')
+
+    args = parser.parse_args()
+
+    targets = {'python': 'pass'}
+    for name, target in entry_points().items():
+        if args.scripts and name not in args.scripts:
+            continue
+
+        module, func = target.split(':')
+        targets[name] = RUN_SCRIPT.format(module=module, func=func, name=name)
+
+    failed = 0
+    print('{:<28} {:>10} {:>10}'.format('script', 'min (ms)', 'median'))
+    for name, code in targets.items():
+        durations, error = measure(code, args.runs)
+        if error is not None:
+            failed += 1
+            print('{:<28} [ERROR] {}'.format(name, error.splitlines()[-1]))
+            continue
+
+        print('{:<28} {:>10.1f} {:>10.1f}'.format(
+            name, min(durations), statistics.median(durations)))
+
+    if failed:
+        sys.exit('[ERROR] {} scripts failed to start'.format(failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
+Last Update: 2026/10/17
+Description: Asynchronous (asyncio) API for the most common operations
+
+# Usage:
+    import asyncio
+    from maasjuju_toolkit import aio
+
+    async def main():
+        results = await aio.get_script_results(['rack1'], skip={'Running'})
+        for row, _, error in await aio.update_domain_name(
+                ['rack1'], 'new.domain.name'):
+            ...
+
+    asyncio.get_event_loop().run_until_complete(main())
+
+# Notes:
+* All functions must be awaited from a running event loop. Thousands of
+  MaaS operations can run concurrently on the same loop. The number of
+  concurrent requests is limited by @jobs (default: Config.jobs), and all
+  requests share the connection pool of `client.py`.
+* Machines are selected with the same filters as the mjt_* scripts, see
+  `util.py:query_machines()`.
+* Functions that change machines update the local database with the
+  changed machines.
+* Queries and updates of the local database are blocking. They run in a
+  separate thread (one for all database work), so that they do not stall
+  other coroutines on the event loop.
+* Functions that operate on many machines return a list of `(machine,
+  result, error)` tuples, like `util.run_parallel()`. They never exit.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from maasjuju_toolkit.client import (
+    MaaSError, SessionAPI, cached_session, store_api_description)
+from maasjuju_toolkit.config import Config
+from maasjuju_toolkit.maas.add_tags import CHUNK_SIZE
+from maasjuju_toolkit.maas.script_results import summarize_script_results
+from maasjuju_toolkit.refresh import (
+    changed_machines, patch_machines, update_db)
+from maasjuju_toolkit.util import (
+    APIDescription, chunks, resolve_machines, store_machine_documents)
+
+
+__session = None
+
+# SQLite work runs in this thread. A single thread keeps writes serialized
+__db_executor = ThreadPoolExecutor(max_workers=1)
+
+
+async def run_blocking(func, *args):
+    """calls blocking @func(*args), e.g. a database query, from a separate
+    thread. Other coroutines keep running in the meantime"""
+    return await asyncio.get_event_loop().run_in_executor(
+        __db_executor, partial(func, *args))
+
+
+async def _connect():
+    """connects to MaaS, downloading the API description, and caches the
+    API description"""
+    _, s = await SessionAPI.connect(
+        Config.maas_api_url, apikey=Config.maas_api_key)
+    version = await s.Version.read()
+    await run_blocking(store_api_description, s, version['version'])
+
+    return s
+
+
+async def session():
+    """returns a session to the MaaS server. Subsequent calls return the
+    same session"""
+    global __session
+    if __session is None:
+        __session = await run_blocking(cached_session) or await _connect()
+
+    return __session
+
+
+async def check_api_description():
+    """same as `client.check_api_description()`. Raises MaaSError on
+    failure"""
+    global __session
+    cached = await run_blocking(
+        APIDescription.get_or_none, APIDescription.url == Config.maas_api_url)
+    if cached is None:
+        return
+
+    s = await session()
+    version = (await s.Version.read())['version']
+    if version != cached.version:
+        print('[INFO] MaaS version changed ({} -> {}), updating the API '
+              'description'.format(cached.version, version))
+        __session = await _connect()
+
+
+async def run_concurrent(func, items, jobs=None):
+    """awaits func(item) for each of @items, running up to @jobs at the
+    same time. Returns a list of `(item, result, error)` tuples, in the
+    order of @items. MaaS errors are returned as `error`"""
+    if jobs is None:
+        jobs = Config.jobs
+
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def run(item):
+        async with semaphore:
+            try:
+                return item, await func(item), None
+            except MaaSError as e:
+                return item, None, e
+
+    return await asyncio.gather(*[run(item) for item in items])
+
+
+async def refresh(incremental=False):
+    """same as `refresh.refresh_db()`. Raises MaaSError on failure"""
+    await check_api_description()
+    s = await session()
+
+    machines = await s.Machines.read()
+    all_ids = {m.get('system_id') for m in machines}
+
+    if incremental:
+        machines = await run_blocking(changed_machines, machines)
+        changed = [m['system_id'] for m in machines]
+        powers = {}
+        for chunk in chunks(changed, 100):
+            powers.update(await s.Machines.power_parameters(id=chunk))
+    else:
+        powers = await s.Machines.power_parameters()
+
+    await run_blocking(store_machine_documents, machines)
+    await run_blocking(update_db, machines, powers, all_ids)
+
+
+async def get_script_results(machines, skip, jobs=None, errors=None):
+    """same as `script_results.get_script_results()`"""
+    s = await session()
+
+    async def read(row):
+        return await s.NodeScriptResults.read(system_id=row.system_id)
+
+    rows = await run_blocking(resolve_machines, machines)
+
+    results = {}
+    for row, scripts, error in await run_concurrent(read, rows, jobs):
+        if error is not None:
+            if errors is not None:
+                errors[row.system_id] = error
+            continue
+
+        summary = summarize_script_results(scripts, skip)
+        if summary:
+            results[row.system_id] = summary
+
+    return results
+
+
+async def update_machine(system_id, **params):
+    """updates machine @system_id, returns the updated machine"""
+    s = await session()
+    machine = await s.Machine.update(system_id=system_id, **params)
+    await run_blocking(patch_machines, [machine])
+
+    return machine
+
+
+async def update_machines(machines, jobs=None, **params):
+    """updates all matching @machines with the same @params"""
+    s = await session()
+
+    async def update(row):
+        return await s.Machine.update(system_id=row.system_id, **params)
+
+    rows = await run_blocking(resolve_machines, machines)
+    results = await run_concurrent(update, rows, jobs)
+    await run_blocking(
+        patch_machines, [result for _, result, error in results if not error])
+
+    return results
+
+
+async def update_tag(tag, add=(), remove=()):
+    """adds machines with system ids @add to @tag, and removes machines
+    with system ids @remove, in chunks of CHUNK_SIZE machines. The tag is
+    created if needed"""
+    s = await session()
+
+    names = [t['name'] for t in await s.Tags.read()]
+    if tag not in names:
+        await s.Tags.create(
+            name=tag, description='Helper tag for nagios checks')
+
+    for action, system_ids in (('add', add), ('remove', remove)):
+        for chunk in chunks(system_ids, CHUNK_SIZE):
+            await s.Tag.update_nodes(name=tag, **{action: chunk})
+
+    # write-through
+    for chunk in chunks(list(add) + list(remove), CHUNK_SIZE):
+        await run_blocking(patch_machines, await s.Machines.read(id=chunk))
+
+
+async def update_domain_name(machines, new_domain, jobs=None):
+    """moves all matching @machines to domain @new_domain. The domain is
+    created if needed"""
+    s = await session()
+
+    names = [d['name'] for d in await s.Domains.read()]
+    if new_domain not in names:
+        await s.Domains.create(name=new_domain, authoritative=True)
+
+    return await update_machines(machines, jobs, domain=new_domain)
@@ -0,0 +1,234 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
+Last Update: 2026/10/17
+Description: MaaS API client
+
+# Notes:
+* Importing python-libmaas is expensive, so only scripts that talk to MaaS
+  should import this module.
+* The API description document of the MaaS server is cached in the local
+  database, so that sessions can be created without downloading it. The
+  cache is checked against the version of the MaaS server on every
+  `mjt_refresh`, and can be cleared with `mjt_refresh --reset-api`.
+* python-libmaas opens a new HTTP connection for every request. Instead,
+  all requests are sent through a pool of keep-alive connections, which is
+  shared by all threads. The pool runs on its own event loop thread, and
+  opens at most `Config.max_connections` connections.
+"""
+
+import asyncio
+import atexit
+import json
+import threading
+
+import aiohttp
+from maas.client import bones
+from maas.client.bones import SessionAPI, CallError, CallResult, helpers
+from maas.client.utils.creds import Credentials
+
+from maasjuju_toolkit.config import Config
+from maasjuju_toolkit.util import exit_with_error, APIDescription
+
+
+# Collection of errors that may happen when using MaaS API
+MaaSError = (CallError, helpers.RemoteError, aiohttp.ClientError)
+
+
+##################################################################
+# CONNECTION POOL
+
+
+class ConnectionPool:
+    """keep-alive HTTP connections to MaaS, shared by all threads"""
+
+    def __init__(self, max_connections, keepalive_timeout):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name='mjt-http', daemon=True)
+        self.thread.start()
+
+        async def create_session():
+            return aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+                limit=max_connections, limit_per_host=max_connections,
+                keepalive_timeout=keepalive_timeout))
+
+        self.session = self.run(create_session()).result()
+
+    def run(self, coro):
+        """schedules @coro on the event loop of the pool, returns a
+        concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def request(self, method, uri, body, headers):
+        """sends a request, returns the response and its content. May be
+        awaited from any event loop"""
+
+        async def do_request():
+            async with self.session.request(
+                    method, uri, data=body, headers=headers) as response:
+                return response, await response.read()
+
+        return await asyncio.wrap_future(self.run(do_request()))
+
+    def close(self):
+        """closes all connections and stops the event loop"""
+        self.run(self.session.close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+__pool = None
+__pool_lock = threading.Lock()
+
+
+def pool():
+    """returns the connection pool, creating it if needed"""
+    global __pool
+    with __pool_lock:
+        if __pool is None:
+            __pool = ConnectionPool(
+                Config.max_connections, Config.keepalive_timeout)
+            atexit.register(__pool.close)
+
+        return __pool
+
+
+async def _dispatch(self, uri, body, headers):
+    """replaces `bones.CallAPI.dispatch()`, sending requests through the
+    connection pool. Otherwise, it behaves the same (it is always awaited
+    by the blocking wrappers of python-libmaas)"""
+    headers.setdefault('Accept', 'application/json,*/*;q=0.9')
+    response, content = await pool().request(
+        self.action.method, uri, body, headers)
+
+    if self.action.handler.session.debug:
+        print(response)
+
+    # 2xx status codes are all okay.
+    if response.status // 100 != 2:
+        request = {
+            'body': body,
+            'headers': headers,
+            'method': self.action.method,
+            'uri': uri,
+        }
+        raise CallError(request, response, content, self)
+
+    if response.content_type is None:
+        data = content
+    elif response.content_type.endswith('/json'):
+        data = json.loads(content.decode('utf-8'))
+    else:
+        data = content
+
+    return CallResult(response, content, data)
+
+
+bones.CallAPI.dispatch = _dispatch
+
+
+##################################################################
+# SESSION
+
+
+__session = None
+
+
+def cached_session():
+    """returns a session using the cached API description, or None if
+    there is no cached API description"""
+    cached = APIDescription.get_or_none(
+        APIDescription.url == Config.maas_api_url)
+    if cached is None:
+        return None
+
+    try:
+        description = json.loads(cached.description)
+    except ValueError:
+        return None
+
+    return SessionAPI(description, Credentials.parse(Config.maas_api_key))
+
+
+def store_api_description(s, version):
+    """caches the API description of session @s, for MaaS @version"""
+    APIDescription.insert(
+        url=Config.maas_api_url,
+        version=version,
+        description=json.dumps(s.description)
+    ).on_conflict_replace().execute()
+
+
+def _connect():
+    """connects to MaaS, downloading the API description, and caches the
+    API description"""
+    _, s = SessionAPI.connect(
+        Config.maas_api_url, apikey=Config.maas_api_key)
+
+    store_api_description(s, server_version(s))
+    return s
+
+
+def server_version(s):
+    """returns the version of the MaaS server"""
+    return s.Version.read()['version']
+
+
+def session():
+    """opens a new session to the MaaS server. subsequent calls return the
+    same session"""
+    global __session
+    if __session:
+        return __session
+
+    try:
+        __session = cached_session() or _connect()
+
+        return __session
+
+    except MaaSError as e:
+        exit_with_error('Could not connect to MaaS: {}'.format(e))
+
+
+def reset_api_description():
+    """removes the cached API description. The next session will download
+    it again"""
+    global __session
+    __session = None
+
+    APIDescription.delete().where(
+        APIDescription.url == Config.maas_api_url).execute()
+
+
+def check_api_description():
+    """checks that the cached API description matches the version of the
+    MaaS server, and downloads it again if not"""
+    cached = APIDescription.get_or_none(
+        APIDescription.url == Config.maas_api_url)
+    if cached is None:
+        return
+
+    try:
+        version = server_version(session())
+    except MaaSError as e:
+        exit_with_error('Could not get MaaS version: {}'.format(e))
+
+    if version != cached.version:
+        print('[INFO] MaaS version changed ({} -> {}), updating the API '
+              'description'.format(cached.version, version))
+        reset_api_description()
+        session()
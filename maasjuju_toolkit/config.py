@@ -36,3 +36,42 @@ class Config:
         'MJT_SQLITE_DB',
         os.path.join(base_dir, 'cache.db')
     )
+
+    # Number of concurrent MaaS API requests for commands that operate
+    # on many machines (override with --jobs)
+    jobs = int(os.getenv('MJT_JOBS', '8'))
+
+    # Maximum MaaS API requests per second for bulk operations (0 means
+    # no limit, override with --rate)
+    rate = float(os.getenv('MJT_RATE', '0'))
+
+    # Number of retries for MaaS API requests that fail with a transient
+    # error (override with --retries)
+    retries = int(os.getenv('MJT_RETRIES', '3'))
+
+    # Maximum number of open (keep-alive) HTTP connections to MaaS, shared
+    # by all threads of a script
+    max_connections = int(os.getenv('MJT_MAX_CONNECTIONS', '16'))
+
+    # Seconds to keep idle HTTP connections to MaaS open
+    keepalive_timeout = int(os.getenv('MJT_KEEPALIVE_TIMEOUT', '30'))
+
+    # Seconds after which cached script results are considered stale
+    script_results_ttl = int(os.getenv('MJT_SCRIPT_RESULTS_TTL', '900'))
+
+    # Seconds after which cached machine details (mjt_get_machine) are
+    # considered stale
+    machine_ttl = int(os.getenv('MJT_MACHINE_TTL', '60'))
+
+    # Seconds to wait for an IPMI command before giving up on a BMC
+    ipmi_timeout = int(os.getenv('MJT_IPMI_TIMEOUT', '30'))
+
+    # Unix socket of the mjt daemon (mjt_daemon). Scripts use the daemon if
+    # it is running. Set to an empty string to never use the daemon
+    daemon_socket = os.getenv(
+        'MJT_DAEMON_SOCKET',
+        os.path.join(base_dir, 'mjt.sock')
+    )
+
+    # Seconds to wait for an answer from the mjt daemon
+    daemon_timeout = int(os.getenv('MJT_DAEMON_TIMEOUT', '300'))
@@ -0,0 +1,169 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
+Last Update: 2026/10/17
+Description: Long running daemon that serves requests of mjt_* scripts
+
+# Usage:
+$ mjt_daemon [--socket /path/to/mjt.sock]
+
+# Notes:
+* The daemon keeps a single MaaS session open, and the machine cache in
+  memory. Scripts that support it (mjt_get_ipmi_info, mjt_script_results
+  list, mjt_check_script_results) send their requests to the daemon if it
+  is running, and do the work themselves if it is not.
+* The socket path is set by the MJT_DAEMON_SOCKET environment variable.
+  Clients and the daemon must use the same path.
+* The socket is only accessible by the user running the daemon, since
+  responses include IPMI credentials.
+* Protocol: the client sends a single JSON line, `{"method": "...",
+  "params": {...}}`, and the daemon answers with `{"result": ...}` or
+  `{"error": "..."}`, then closes the connection.
+"""
+
+import argparse
+import json
+import os
+import signal
+import socketserver
+import sys
+import traceback
+
+from maasjuju_toolkit.client import session
+from maasjuju_toolkit.config import Config
+from maasjuju_toolkit.maas.get_ipmi_info import get_ipmi_info
+from maasjuju_toolkit.maas.script_results import get_script_results
+from maasjuju_toolkit.nagios.check_script_results import (
+    script_results_status)
+from maasjuju_toolkit.util import (
+    resolve_machines, format_nagios, ensure_event_loop)
+
+
+def query_machines(machines):
+    """returns list of matching machines as dicts"""
+    return [row.__data__ for row in resolve_machines(machines)]
+
+
+def script_results(machines, skip, jobs=None):
+    """returns script results, along with errors"""
+    errors = {}
+    results = get_script_results(machines, set(skip), jobs, errors)
+
+    return {
+        'results': results,
+        'errors': {k: str(v) for k, v in errors.items()}
+    }
+
+
+def check_script_results(machines, max_age=None):
+    """returns nagios output and exit code"""
+    text, exitcode = format_nagios(*script_results_status(machines, max_age))
+
+    return {'text': text, 'exitcode': exitcode}
+
+
+METHODS = {
+    'query_machines': query_machines,
+    'get_ipmi_info': get_ipmi_info,
+    'script_results': script_results,
+    'check_script_results': check_script_results,
+}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """handles a single request"""
+
+    def handle(self):
+        loop = ensure_event_loop()
+
+        try:
+            request = json.loads(self.rfile.readline().decode())
+            method = METHODS[request['method']]
+            response = {'result': method(**request.get('params', {}))}
+
+        except SystemExit:
+            # the scripts exit on errors (e.g. no matching machines). let
+            # the client run the request itself, to get the proper output
+            response = {'error': 'exited'}
+
+        except Exception as e:
+            traceback.print_exc()
+            response = {'error': '{}: {}'.format(e.__class__.__name__, e)}
+
+        finally:
+            # each request runs in a new thread, do not leak its loop
+            if loop is not None:
+                loop.close()
+
+        self.wfile.write(json.dumps(response, default=str).encode())
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def run_daemon(socket_path):
+    """serves requests on @socket_path until interrupted"""
+    if not socket_path:
+        print('[ERROR] No socket path, set MJT_DAEMON_SOCKET')
+        return
+
+    # connect to MaaS now, so that requests do not have to
+    session()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    old_umask = os.umask(0o077)
+    try:
+        server = Server(socket_path, RequestHandler)
+    finally:
+        os.umask(old_umask)
+
+    # clean up on SIGTERM as well
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+    print('[INFO] Listening on {}'.format(socket_path))
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def main():
+    """parses arguments and does work"""
+    parser = argparse.ArgumentParser(
+        description='Serve requests of mjt_* scripts over a Unix socket'
+    )
+    parser.add_argument(
+        '--socket',
+        type=str,
+        default=Config.daemon_socket,
+        help='Path of the Unix socket'
+    )
+
+    args = parser.parse_args()
+    run_daemon(args.socket)
+
+
+if __name__ == '__main__':
+    main()
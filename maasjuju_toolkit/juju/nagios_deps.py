@@ -15,7 +15,7 @@
 
 """
 Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
-Last Update: 2019/10/24
+Last Update: 2026/10/17
 Description: Creates Nagios configuration for host dependencies based on
              dependencies derived from the Juju status output.
 Requires: Juju, PyNag
@@ -27,14 +27,34 @@ $ pynag list address host_name WHERE object_type=host \
 $ pynag list host_name service_description WHERE object_type=service \
     '--seperator=|' --width=0 --quiet > pynag_services.txt
 
-$ mjt_juju_nagios_deps [--juju juju_status.json] [--subnet CIDR] \
-    [--services pynag_services.txt] [--hosts pynag_hosts.txt]
+$ mjt_juju_nagios_deps [--juju juju_status.json [...]] [--subnet CIDR] \
+    [--services pynag_services.txt] [--hosts pynag_hosts.txt] \
+    [--incremental]
 
 # Notes:
 * `juju status` should run on the Juju controller machine
 * `pynag` should run on the machine where Nagios is running
 * The output is a Nagios configuration file. Add it under /etc/nagios3/conf.d
   and then restart Nagios.
+* The configuration is streamed to a temporary file, which then replaces
+  the output file. Nagios never reads a partially written file, and memory
+  usage does not depend on the number of hosts and services.
+* The Juju status is read one machine at a time (with ijson, if installed),
+  keeping only the fields needed. The rest of the document is never held in
+  memory, and generation starts as soon as the first machine is parsed.
+* Many Juju status files (e.g. one per model or controller) can be given,
+  as files or as directories of `.json` files. They are parsed in parallel
+  worker processes and merged: machines are identified by display name and
+  containers by instance id. An IP address that appears on different
+  machines/containers is reported, but not removed from any of them.
+* With "--incremental", the configuration of each Juju machine is cached in
+  the local database, along with a fingerprint of the machine (and its
+  containers) in the Juju status and of the related Nagios hosts and
+  services. Only machines whose fingerprint changed are rendered again. If
+  nothing changed since the last run for the same output file, the output
+  file is not written and the script exits with code 10
+  (`UNCHANGED_EXIT_CODE`), so that Nagios only needs a reload on exit
+  code 0.
 
 # Output:
 The output is a Nagios config file that describes Juju host and service
@@ -45,22 +65,39 @@ reside. Furthermore, all the services of a container depend upon a well-known
 service of the physical machine (by default: the SSH service), so as to avoid
 mass notification messages in case a physical machine fails.
 
+Containers can be nested to any depth (e.g. LXD inside a KVM guest on a
+physical machine). Each container only depends on its closest parent that is
+monitored by Nagios, and its services only depend on the well-known service
+of that parent. Duplicate dependencies, or those of a container that resolves
+to the same Nagios host as its parent, are not written.
+
 If any physical hosts listed under Juju are not present in Nagios, then they
 are created as well. If there are multiple IP addresses, the one belonging in
 the subnet CIDR is chosen.
 """
 
 import argparse
+import hashlib
 import json
+import os
+import re
+import sys
 from collections import defaultdict
 
 from netaddr import IPNetwork, IPAddress
 
-from maasjuju_toolkit.util import exit_with_error
+from maasjuju_toolkit.util import (
+    db, NagiosFragment, exit_with_error, write_atomic)
 
 # Container services will depend on this service of the physical machine
 WELL_KNOWN_SERVICE = 'SSH'
 
+# Exit code of incremental runs when the output file did not change
+UNCHANGED_EXIT_CODE = 10
+
+# Bytes to read at a time from the Juju status
+READ_CHUNK_SIZE = 1 << 20
+
 HOST_TEMPLATE = '''
 
 ##########################################################################
@@ -110,16 +147,269 @@ define servicedependency {
 '''
 
 
-def get_juju_status(f_name):
-    """parses Juju status JSON and returns as dict"""
+def juju_container(container):
+    """returns the fields of a @container of the Juju status that are used
+    for the configuration, including nested containers. Raises KeyError if
+    any are missing"""
+    result = {
+        'instance-id': container['instance-id'],
+        'ip-addresses': container['ip-addresses'],
+    }
+    if 'containers' in container:
+        result['containers'] = {
+            name: juju_container(nested)
+            for name, nested in container['containers'].items()
+        }
+
+    return result
+
+
+def juju_machine(machine):
+    """returns the fields of a @machine of the Juju status that are used
+    for the configuration. Raises KeyError if any are missing"""
+    result = {
+        'display-name': machine['display-name'],
+        'ip-addresses': machine['ip-addresses'],
+    }
+    if 'containers' in machine:
+        result['containers'] = {
+            name: juju_container(container)
+            for name, container in machine['containers'].items()
+        }
+
+    return result
+
+
+def iter_containers(machine):
+    """yields all containers of @machine, at any depth"""
+    for container in (machine.get('containers') or {}).values():
+        yield container
+        yield from iter_containers(container)
+
+
+class JSONReader:
+    """reads values of a JSON document from a file one at a time, so that
+    the whole document never needs to be in memory"""
+
+    WHITESPACE = re.compile(r'\s*')
+
+    def __init__(self, fin, chunk_size=READ_CHUNK_SIZE):
+        self.fin = fin
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """reads more data. Returns False at the end of the file"""
+        # read at least as much as is buffered, so that values spanning
+        # many chunks are decoded a logarithmic number of times
+        data = self.fin.read(max(self.chunk_size, len(self.buf) - self.pos))
+        if not data:
+            self.eof = True
+            return False
+
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """skips whitespace, returns the next character"""
+        while True:
+            self.pos = self.WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+
+            if not self.fill():
+                raise ValueError('Unexpected end of file')
+
+    def expect(self, chars):
+        """consumes the next character, which must be one of @chars"""
+        char = self.peek()
+        if char not in chars:
+            raise ValueError('Expected {!r} but got {!r}'.format(
+                chars, char))
+
+        self.pos += 1
+        return char
+
+    def value(self):
+        """decodes and returns the next value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+
+                # a number near the end of the buffer may be incomplete,
+                # e.g. "1" of "1.5", or "1" of "1e+3"
+                if (self.eof or end + 2 < len(self.buf)
+                        or not isinstance(value, (int, float))):
+                    self.pos = end
+                    return value
+
+            except ValueError:
+                if self.eof:
+                    raise
+
+            self.fill()
+
+    def keys(self):
+        """iterates the keys of the next object. The caller must consume
+        the value of each key before asking for the next one"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise ValueError('Expected object key, got {!r}'.format(key))
+
+            self.expect(':')
+            yield key
+
+            if self.expect(',}') == '}':
+                return
+
+
+def _iter_machines_ijson(fin, ijson):
+    """same as `iter_juju_machines()`, using ijson"""
+    found = False
+    for machine_id, machine in ijson.kvitems(fin, 'machines'):
+        found = True
+        yield machine_id, juju_machine(machine)
+
+    if not found:
+        # ijson does not tell apart missing and empty "machines"
+        fin.seek(0)
+        if 'machines' not in next(ijson.items(fin, ''), {}):
+            raise KeyError('machines')
+
+
+def iter_juju_machines(f_name):
+    """parses Juju status JSON file @f_name. Yields `(machine_id, machine)`
+    tuples, as soon as each machine is parsed. Only the fields needed for
+    the configuration are kept, see `juju_machine()`. Reading stops after
+    the machines, the rest of the file is ignored"""
     try:
-        with open(f_name, 'r') as fin:
-            return json.load(fin)
+        import ijson
+        if not hasattr(ijson, 'kvitems'):
+            ijson = None
+    except ImportError:
+        ijson = None
+
+    try:
+        with open(f_name, 'rb' if ijson else 'r') as fin:
+            if ijson:
+                yield from _iter_machines_ijson(fin, ijson)
+                return
+
+            reader = JSONReader(fin)
+            for key in reader.keys():
+                if key != 'machines':
+                    reader.value()
+                    continue
 
-    except json.JSONDecodeError as e:
+                for machine_id in reader.keys():
+                    yield machine_id, juju_machine(reader.value())
+
+                return
+
+            raise KeyError('machines')
+
+    except (ValueError, getattr(ijson, 'JSONError', ValueError)) as e:
         exit_with_error('[EXCEPTION] Invalid input file: {}'.format(e))
 
 
+def load_juju_machines(f_name):
+    """returns a list of all machines of Juju status file @f_name, see
+    `iter_juju_machines()`. Runs in worker processes"""
+    return list(iter_juju_machines(f_name))
+
+
+def juju_status_files(paths):
+    """returns the Juju status files for @paths. Directories are expanded
+    to the JSON files that they contain"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.endswith('.json')))
+        elif os.path.exists(path):
+            files.append(path)
+        else:
+            exit_with_error('[ERROR] No such file: {}'.format(path))
+
+    if not files:
+        exit_with_error('[ERROR] No Juju status files found')
+
+    return files
+
+
+def parse_juju_status_files(files):
+    """parses Juju status @files in parallel, using worker processes.
+    Returns a list of `(file, machines)` tuples"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = min(len(files), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(zip(files, executor.map(load_juju_machines, files)))
+
+
+def merge_juju_machines(sources):
+    """merges machines of many Juju status files. @sources is a list of
+    `(file, machines)` tuples. Machines with the same display name are
+    merged, and containers with the same instance id are kept once. An IP
+    address that belongs to different machines/containers is reported, but
+    kept for all of them. Returns a list of `(display_name, machine)`
+    tuples"""
+    merged = {}
+    owners = {}
+
+    def merge_addresses(target, addresses, owner, f_name):
+        """adds @addresses of @owner to @target. Addresses that are already
+        used by another machine or container are reported"""
+        for ip in addresses:
+            if ip in target['ip-addresses']:
+                continue
+
+            first = owners.setdefault(ip, (owner, f_name))
+            if first[0] != owner:
+                print('[WARN] IP {} of {} ({}) is also used by {} ({})'
+                      .format(ip, owner, f_name, first[0], first[1]))
+
+            target['ip-addresses'].append(ip)
+
+    def merge_containers(target, source, f_name):
+        """merges the (nested) containers of @source into @target"""
+        if 'containers' not in source:
+            return
+
+        containers = target.setdefault('containers', {})
+        for container in source['containers'].values():
+            instance_id = container['instance-id']
+            existing = containers.setdefault(instance_id, {
+                'instance-id': instance_id, 'ip-addresses': []})
+
+            merge_addresses(
+                existing, container['ip-addresses'], instance_id, f_name)
+            merge_containers(existing, container, f_name)
+
+    for f_name, machines in sources:
+        for _, machine in machines:
+            name = machine['display-name']
+            target = merged.setdefault(name, {
+                'display-name': name, 'ip-addresses': []})
+
+            merge_addresses(target, machine['ip-addresses'], name, f_name)
+            merge_containers(target, machine, f_name)
+
+    return list(merged.items())
+
+
 def parse_pynag_hosts(f_name):
     """parses Nagios hosts. Returns them as a {'ip_address': 'host_name'}
     dict"""
@@ -166,116 +456,297 @@ def parse_pynag_services(f_name):
     return result
 
 
-def nagios_juju_deps(juju_status, pynag_hosts, pynag_services, subnet,
-                     outfile):
-    """generates Nagios host and service dependencies and writes to outfile"""
-    hosts = parse_pynag_hosts(pynag_hosts)
-    services = parse_pynag_services(pynag_services)
-    juju = get_juju_status(juju_status)
+def render_host(display_name, ip_address):
+    """returns Nagios configuration for a new host"""
+    return (
+        HOST_TEMPLATE
+        .replace('{COMMENT}', 'Auto created by mjt_juju_nagios_deps')
+        .replace('{DISPLAY_NAME}', display_name)
+        .replace('{IP_ADDRESS}', ip_address)
+    )
+
+
+def render_host_dependency(comment, parent, child):
+    """returns Nagios configuration for a host dependency"""
+    return (
+        HOST_DEPENDENCY_TEMPLATE
+        .replace('{COMMENT}', comment)
+        .replace('{PARENT}', parent)
+        .replace('{CHILD}', child)
+    )
+
+
+def render_service_dependency(comment, parent_host, parent_service,
+                              dependent_host, dependent_service):
+    """returns Nagios configuration for a service dependency"""
+    return (
+        SERVICE_DEPENDENCY_TEMPLATE
+        .replace('{COMMENT}', comment)
+        .replace('{PARENT_HOST}', parent_host)
+        .replace('{PARENT_SERVICE}', parent_service)
+        .replace('{DEPENDENT_HOST}', dependent_host)
+        .replace('{DEPENDENT_SERVICE}', dependent_service)
+    )
+
+
+def choose_ip_address(machine, subnet):
+    """returns the IP address of @machine in @subnet. If there is none,
+    asks the user. Returns None if @machine has no IP addresses at all"""
+    if not machine['ip-addresses']:
+        print('[ERROR] [{}] Has no IP addresses'.format(
+            machine['display-name']))
+        return None
+
+    for ip in machine['ip-addresses']:
+        if IPAddress(ip) in IPNetwork(subnet):
+            print('Will use IP address', ip)
+            return ip
+
+    print('[WARN] [{}] No IPs in {}'.format(machine['display-name'], subnet))
+    print('Choose which IP address to use:')
+
+    ip_address = None
+    while ip_address not in machine['ip-addresses']:
+        ip_address = input('> ')
+
+    return ip_address
+
+
+def nagios_host(addresses, hosts):
+    """returns the Nagios host with one of @addresses, or None"""
+    for address in addresses:
+        host = hosts.get(address)
+        if host is not None:
+            return host
+
+    return None
+
+
+def container_edges(parent, label, containers, hosts):
+    """yields the edges of the dependency graph for @containers (nested at
+    any depth) of Nagios host @parent, as `(parent, parent_label, host,
+    container)` tuples. Containers that are not in Nagios are reported,
+    and their own containers depend on @parent instead"""
+    for container in containers.values():
+        host = nagios_host(container['ip-addresses'], hosts)
+        nested = container.get('containers') or {}
+
+        if host is None:
+            print('[WARN] [{}] Unknown Nagios host ({})'.format(
+                container['instance-id'], container['ip-addresses']))
+            yield from container_edges(parent, label, nested, hosts)
+            continue
+
+        yield parent, label, host, container
+        yield from container_edges(
+            host, container['instance-id'], nested, hosts)
+
+
+def unique_edges(edges):
+    """yields the dependency graph @edges (tuples whose first and third
+    items are the parent and child host), without self-loops and
+    duplicates. The order of @edges is kept"""
+    seen = set()
+    for edge in edges:
+        parent, child = edge[0], edge[2]
+        if parent == child or (parent, child) in seen:
+            continue
+
+        seen.add((parent, child))
+        yield edge
+
+
+def machine_config(machine, hosts, services, subnet):
+    """generates Nagios host and service dependencies for a @machine of
+    the Juju status. Yields the configuration one block at a time"""
+
+    # p_host:  hostname of the parent host
+    # d_host:  hostname of the dependent host
+
+    p_host = nagios_host(machine['ip-addresses'], hosts)
+
+    if p_host is None:
+        print('[WARN] [{}] Unknown Nagios host: ({})'.format(
+            machine['display-name'], machine['ip-addresses']))
+
+        cons = machine.get('containers')
+        if cons:
+            print(
+                '[WARN] [{}] Has {} containers. Will create'.format(
+                    machine['display-name'], len(cons)))
+
+            ip_address = choose_ip_address(machine, subnet)
+            if ip_address is None:
+                return
+
+            yield render_host(machine['display-name'], ip_address)
+
+            p_host = machine['display-name']
+        else:
+            print('[WARN] [{}] has no containers, skipping'.format(
+                machine['display-name']))
+
+    if WELL_KNOWN_SERVICE not in services.get(p_host, []):
+        print('[WARN] [{}] Service {} does not exist'.format(
+            p_host, WELL_KNOWN_SERVICE))
 
-    output = ''
     try:
-        # p_address, p_host:  IP address and hostname of parent host
-        # d_address, d_host:  IP address and hostname of dependent host
-
-        for machine in juju['machines'].values():
-
-            p_host = None
-            for p_address in machine['ip-addresses']:
-                p_host = hosts.get(p_address)
-                if p_host is not None:
-                    break
-
-            if p_host is None:
-                print('[WARN] [{}] Unknown Nagios host: ({})'.format(
-                    machine['display-name'], machine['ip-addresses']))
-
-                cons = machine.get('containers')
-                if cons:
-                    print(
-                        '[WARN] [{}] Has {} containers. Will create'.format(
-                            machine['display-name'], len(cons)))
-
-                    ip_address = None
-                    for ip in machine['ip-addresses']:
-                        if IPAddress(ip_address) in IPNetwork(subnet):
-                            ip_address = ip
-                            print('Will use IP address', ip_address)
-                            break
-
-                    if not ip_address:
-                        print('[WARN] [{}] No IPs in {}'.format(
-                            machine['display-name'], subnet))
-                        print('Choose which IP address to use:')
-
-                        while ip_address not in machine['ip-addresses']:
-                            ip_address = input('> ')
-
-                    output += (
-                        HOST_TEMPLATE
-                        .replace('{COMMENT}',
-                                 'Auto created by mjt_juju_nagios_deps')
-                        .replace('{DISPLAY_NAME}', machine['display-name'])
-                        .replace('{IP_ADDRESS}', ip_address)
-                    )
-
-                    p_host = machine['display-name']
-                else:
-                    print('[WARN] [{}] has no containers, skipping'.format(
-                        machine['display-name']))
-
-            if WELL_KNOWN_SERVICE not in services.get(p_host, []):
+        containers = machine['containers']
+    except KeyError:
+        return
+
+    checked = {p_host}
+    for parent, label, d_host, container in unique_edges(
+            container_edges(
+                p_host, machine['display-name'], containers, hosts)):
+
+        # nested containers are parents as well
+        if parent not in checked:
+            checked.add(parent)
+            if WELL_KNOWN_SERVICE not in services.get(parent, []):
                 print('[WARN] [{}] Service {} does not exist'.format(
-                    p_host, WELL_KNOWN_SERVICE))
+                    parent, WELL_KNOWN_SERVICE))
+
+        # adds host dependencies
+        yield render_host_dependency(
+            '({}) => ({})'.format(container['instance-id'], label),
+            parent, d_host)
+
+        for service in services.get(d_host, []):
+            yield render_service_dependency(
+                '({}/{}) => ({}/{})'.format(
+                    container['instance-id'], service,
+                    label, WELL_KNOWN_SERVICE),
+                parent, WELL_KNOWN_SERVICE, d_host, service)
+
+
+def nagios_config(machines, hosts, services, subnet):
+    """generates Nagios host and service dependencies for Juju @machines
+    (`(machine_id, machine)` tuples). Yields the configuration one block
+    at a time"""
+    for _, machine in machines:
+        yield from machine_config(machine, hosts, services, subnet)
+
+
+def machine_fingerprint(machine, hosts, services, subnet):
+    """returns a hash of everything that the configuration of @machine
+    depends on: the machine and its containers in the Juju status, and the
+    related Nagios hosts and services"""
+    addresses = list(machine.get('ip-addresses', []))
+    for container in iter_containers(machine):
+        addresses.extend(container.get('ip-addresses', []))
+
+    names = {ip: hosts.get(ip) for ip in addresses}
+    related = set(names.values()) | {machine.get('display-name')}
+    data = {
+        'machine': machine,
+        'hosts': names,
+        'services': {h: services.get(h, []) for h in related if h},
+        'subnet': subnet,
+        'well_known_service': WELL_KNOWN_SERVICE,
+    }
+
+    return hashlib.sha1(
+        json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def cached_config(machines, cached, hosts, services, subnet, stats):
+    """same as `nagios_config()`, but for a list of @machines (`(key,
+    machine, fingerprint)` tuples). Machines whose fingerprint matches the
+    one in @cached are not rendered again, their configuration is read
+    from the local database instead. The number of rendered machines is
+    counted in @stats"""
+    for key, machine, fingerprint in machines:
+        if cached.get(key) == fingerprint:
+            yield NagiosFragment.get(NagiosFragment.key == key).fragment
+            continue
+
+        fragment = ''.join(machine_config(machine, hosts, services, subnet))
+        NagiosFragment.insert(
+            key=key, fingerprint=fingerprint, fragment=fragment
+        ).on_conflict_replace().execute()
+
+        stats['rendered'] += 1
+        yield fragment
+
+
+def incremental_nagios_juju_deps(machines, hosts, services, subnet,
+                                 outfile):
+    """writes the configuration for Juju @machines to @outfile, only
+    rendering machines that changed since the last run. Exits with
+    UNCHANGED_EXIT_CODE if the output would be the same"""
+    output_key = os.path.abspath(outfile)
+    prefix = output_key + ':'
+
+    machines = [
+        (prefix + machine_id, machine,
+         machine_fingerprint(machine, hosts, services, subnet))
+        for machine_id, machine in machines
+    ]
+    digest = hashlib.sha1('\n'.join(
+        '{} {}'.format(key, fp) for key, _, fp in machines
+    ).encode()).hexdigest()
+
+    state = NagiosFragment.get_or_none(NagiosFragment.key == output_key)
+    if (state is not None and state.fingerprint == digest
+            and os.path.exists(outfile)):
+        print('[INFO] Configuration did not change:', outfile)
+        sys.exit(UNCHANGED_EXIT_CODE)
+
+    cached = {
+        r.key: r.fingerprint for r in
+        NagiosFragment.select(NagiosFragment.key, NagiosFragment.fingerprint)
+        .where(NagiosFragment.key.startswith(prefix))
+        if r.key.startswith(prefix)
+    }
+
+    stats = {'rendered': 0}
+    with db.atomic():
+        write_atomic(outfile, cached_config(
+            machines, cached, hosts, services, subnet, stats))
+
+        # forget machines that no longer exist
+        stale = set(cached) - {key for key, _, _ in machines}
+        if stale:
+            NagiosFragment.delete().where(
+                NagiosFragment.key.in_(list(stale))).execute()
+
+        NagiosFragment.insert(
+            key=output_key, fingerprint=digest
+        ).on_conflict_replace().execute()
+
+    print('[INFO] Rendered {} of {} machines'.format(
+        stats['rendered'], len(machines)))
 
-            try:
-                containers = machine['containers']
-            except KeyError:
-                continue
 
-            for name, container in containers.items():
-                d_host = None
-                for d_address in container['ip-addresses']:
-                    d_host = hosts.get(d_address)
-                    if d_host is not None:
-                        break
+def nagios_juju_deps(juju_status, pynag_hosts, pynag_services, subnet,
+                     outfile, incremental=False):
+    """generates Nagios host and service dependencies and writes to outfile.
+    @juju_status is a list of Juju status files or directories. if
+    @incremental, only changed machines are rendered"""
+    hosts = parse_pynag_hosts(pynag_hosts)
+    services = parse_pynag_services(pynag_services)
 
-                if d_host is None:
-                    print('[WARN] [{}] Unknown Nagios host ({})'.format(
-                        container['instance-id'], container['ip-addresses']))
-                    continue
+    files = juju_status_files(juju_status)
+    try:
+        if len(files) == 1:
+            machines = iter_juju_machines(files[0])
+        else:
+            machines = merge_juju_machines(parse_juju_status_files(files))
+
+        if incremental:
+            incremental_nagios_juju_deps(
+                machines, hosts, services, subnet, outfile)
+        else:
+            write_atomic(
+                outfile, nagios_config(machines, hosts, services, subnet))
 
-                # adds host dependencies
-                output += (
-                    HOST_DEPENDENCY_TEMPLATE
-                    .replace('{COMMENT}', '({}) => ({})'.format(
-                        container['instance-id'], machine['display-name']))
-                    .replace('{PARENT}', p_host)
-                    .replace('{CHILD}', d_host)
-                )
-
-                for service in services.get(d_host, []):
-                    output += (
-                        SERVICE_DEPENDENCY_TEMPLATE
-                        .replace(
-                            '{COMMENT}', '({}/{}) => ({}/{})'.format(
-                                container['instance-id'], service,
-                                machine['display-name'], WELL_KNOWN_SERVICE))
-                        .replace('{PARENT_HOST}', p_host)
-                        .replace('{PARENT_SERVICE}', WELL_KNOWN_SERVICE)
-                        .replace('{DEPENDENT_HOST}', d_host)
-                        .replace('{DEPENDENT_SERVICE}', service)
-                    )
+        print('[SUCCESS] Configuration was written to', outfile)
 
     except KeyError as e:
         exit_with_error(
             '[EXCEPTION] Invalid Juju status format: {}'.format(e))
 
-    try:
-        with open(outfile, 'w') as f_out:
-            f_out.write(output)
-
-        print('[SUCCESS] Configuration was written to', outfile)
     except OSError as e:
         print('[EXCEPTION] Writing to {} failed: {}'.format(outfile, e))
 
@@ -288,8 +759,8 @@ def main():
     )
 
     parser.add_argument(
-        '--juju', type=str,
-        help='Juju status (as json file)',
+        '--juju', type=str, nargs='+',
+        help='Juju status (as json files, or directories of json files)',
         required=True, default=None
     )
     parser.add_argument(
@@ -312,11 +783,17 @@ def main():
         help='subnet to choose for new hosts with multiple IP addresses',
         required=False, default='0.0.0.0/0'
     )
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help='only render machines that changed since the last run. exits '
+             'with code {} if the output did not change'.format(
+                 UNCHANGED_EXIT_CODE)
+    )
 
     args = parser.parse_args()
     nagios_juju_deps(
         args.juju, args.pynag_hosts, args.pynag_services,
-        args.subnet, args.outfile)
+        args.subnet, args.outfile, args.incremental)
 
 
 if __name__ == '__main__':
@@ -15,31 +15,70 @@
 
 """
 Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
-Last Update: 2019/05/09
+Last Update: 2026/10/17
 Description: Adds tags to MaaS machines
 
 # Usage:
-$ mjt_add_tags [tag] [machine] [machine]
+$ mjt_add_tags [tag] [machine] [machine] [--remove | --sync]
 
 # Notes:
 * Machines can be matched using system id, hostname, domain name or tags.
   See `utils.py:query_machines()` for details.
 * New tags will be automatically created if needed.
+* Machines are added to (or removed from) the tag in bulk, using one
+  MaaS request for every `--chunk-size` machines.
+* The local database is updated with the changed machines.
+* With `--sync`, the tag will contain exactly the matching machines. The
+  machines that currently have the tag are read from the local database,
+  so run `mjt_refresh` first.
 """
 
 import argparse
 
+from maasjuju_toolkit.client import session, MaaSError
+from maasjuju_toolkit.refresh import reread_machines
 from maasjuju_toolkit.util import (
-    query_machines, exit_with_error, session, MaaSError)
+    MaaSCache, MachineTag, chunks, resolve_machines, exit_with_error)
 
 
-def add_tags(new_tag, machines):
-    """adds tags to machines"""
+CHUNK_SIZE = 100
+
+
+def tagged_machines(tag):
+    """returns all machines that have @tag, according to the local
+    database"""
+    return list(MaaSCache.select().where(MaaSCache.system_id.in_(
+        MachineTag.select(MachineTag.system_id).where(MachineTag.tag == tag)
+    )))
+
+
+def update_nodes(tag, action, machines, chunk_size=CHUNK_SIZE):
+    """adds (@action='add') or removes (@action='remove') @machines to @tag,
+    using one MaaS request for every @chunk_size machines"""
+    label = 'Added' if action == 'add' else 'Removed'
+    for chunk in chunks(machines, chunk_size):
+        try:
+            session().Tag.update_nodes(
+                name=tag, **{action: [r.system_id for r in chunk]})
+
+        except MaaSError as e:
+            exit_with_error('[ERROR] MaaS: {} ({} machines)'.format(
+                e, len(chunk)))
+
+        for r in chunk:
+            print('[{}] [{}] [OK] {} tag {}'.format(
+                r.system_id, r.hostname, label, tag))
+
+
+def add_tags(new_tag, machines, remove=False, sync=False,
+             chunk_size=CHUNK_SIZE):
+    """adds tags to machines. if @remove, removes the tag instead. if
+    @sync, the tag is set to exactly the matching machines"""
 
     if not machines:
         exit_with_error('[ERROR] You did not specify any machines.')
 
-    results = query_machines(machines)
+    results = resolve_machines(machines)
     if not results:
         exit_with_error('[INFO] No matching machines found.')
 
@@ -49,6 +88,10 @@ def add_tags(new_tag, machines):
         names = [t['name'] for t in all_tags]
 
         if new_tag not in names:
+            if remove:
+                exit_with_error('[INFO] Tag {} does not exist.'.format(
+                    new_tag))
+
             print('[INFO] Tag {} does not exist, creating...'.format(new_tag))
             session().Tags.create(
                 name=new_tag,
@@ -58,18 +101,29 @@ def add_tags(new_tag, machines):
     except MaaSError as e:
         exit_with_error('[ERROR] MaaS: {}'.format(e))
 
-    # updates machines, one by one
-    for r in results:
-        try:
-            session().Tag.update_nodes(name=new_tag, system_id=r.system_id)
-            print('[{}] [{}] [OK] Added tag {}'.format(
-                r.system_id, r.hostname, new_tag))
+    if remove:
+        add, delete = [], results
 
-        except MaaSError as e:
-            exit_with_error('[{}] [{}] [ERROR] MaaS: {}'.format(
-                r.system_id, r.hostname, e))
+    elif sync:
+        # compute the diff against the local database
+        target = {r.system_id for r in results}
+        current = tagged_machines(new_tag)
+        current_ids = {r.system_id for r in current}
+
+        add = [r for r in results if r.system_id not in current_ids]
+        delete = [r for r in current if r.system_id not in target]
+
+    else:
+        add, delete = results, []
+
+    try:
+        update_nodes(new_tag, 'add', add, chunk_size)
+        update_nodes(new_tag, 'remove', delete, chunk_size)
+    finally:
+        # write-through, also for the changes done before any error
+        reread_machines([r.system_id for r in add + delete])
 
-    print('Done. Refresh machine list with "mjt_refresh".')
+    print('Done.')
 
 
 def main():
@@ -89,9 +143,27 @@ def main():
         nargs='+',
         help='Hostname, system id, domain, tags'
     )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        '--remove',
+        action='store_true',
+        help='Remove the tag from the machines instead'
+    )
+    mode.add_argument(
+        '--sync',
+        action='store_true',
+        help='Set the tag to exactly the matching machines'
+    )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=CHUNK_SIZE,
+        help='Machines per MaaS request (default: {})'.format(CHUNK_SIZE)
+    )
 
     args = parser.parse_args()
-    add_tags(args.tag, args.machines)
+    add_tags(args.tag, args.machines, args.remove, args.sync,
+             args.chunk_size)
 
 
 if __name__ == '__main__':
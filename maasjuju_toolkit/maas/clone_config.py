@@ -15,62 +15,193 @@
 
 """
 Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
-Last Update: 2019/11/08
+Last Update: 2026/10/17
 Description: Clone storage and/or interface configuration between machines
 
 # Usage:
 $ mjt_clone_config --source SOURCE --storage --interfaces [--force] \
     --destinations DEST_1 [DEST_2 ...]
+$ mjt_clone_config --plan plan.json --storage --interfaces [--force]
+
+# Plan file:
+A JSON (or YAML, if PyYAML is installed) mapping from source machine to a
+list of destination machines, e.g.:
+
+    {
+        "profile-a": ["rack1", "rack2"],
+        "profile-b": ["gpu-nodes"]
+    }
 
 # Notes:
 * Machines can be matched using system id, hostname, domain name or tags.
   See `utils.py:query_machines()` for details.
 * This may be a destructive operation. The scripts asks for confirmation by
-  default, but accepts a '--force' flag.
+  default (once for the whole plan), but accepts a '--force' flag.
+* Destinations are cloned in chunks of `--chunk-size` machines, with up to
+  `--jobs` concurrent MaaS requests. A failed chunk does not affect the
+  others.
 """
 
 import argparse
+import json
+import time
 
+from maasjuju_toolkit.client import session
+from maasjuju_toolkit.config import Config
 from maasjuju_toolkit.util import (
-    query_machines, exit_with_error, session, MaaSError)
+    MaaSCache, chunks, machine_matches, exit_with_error, print_summary,
+    run_parallel)
+
+
+CHUNK_SIZE = 50
+
+
+def load_plan(path):
+    """reads a clone plan from @path. Returns a dict of source filter to
+    a list of destination filters"""
+    try:
+        with open(path) as fin:
+            if path.endswith(('.yaml', '.yml')):
+                try:
+                    import yaml
+                except ImportError:
+                    exit_with_error('[ERROR] PyYAML is required for YAML '
+                                    'plans, use JSON instead.')
+
+                plan = yaml.safe_load(fin)
+            else:
+                plan = json.load(fin)
+
+    except (OSError, ValueError) as e:
+        exit_with_error('[ERROR] Could not read plan: {}'.format(e))
+
+    if not isinstance(plan, dict) or not plan:
+        exit_with_error('[ERROR] Plan must map sources to destinations.')
+
+    result = {}
+    for source, dests in plan.items():
+        if isinstance(dests, str):
+            dests = [dests]
+
+        # an empty filter list would match every machine
+        if (not isinstance(dests, list) or not dests
+                or not all(isinstance(d, str) and d for d in dests)):
+            exit_with_error(
+                '[ERROR] Destinations of {} must be a non-empty list of '
+                'machine filters, got: {!r}'.format(source, dests))
+
+        result[str(source)] = dests
+
+    return result
+
+
+def resolve_plan(plan):
+    """resolves the machine filters of @plan. Returns a list of
+    `(source, destinations)` tuples. Exits if a source does not match
+    exactly one machine, if a destination appears more than once, or if a
+    source is also a destination"""
+
+    # all filters are matched during a single pass over the cache
+    rows = list(MaaSCache.select().order_by(MaaSCache.fqdn))
+
+    def resolve(machine_filters):
+        return [
+            r for r in rows
+            if any(machine_matches(r, f) for f in machine_filters)
+        ]
+
+    resolved, seen = [], {}
+    for source_filter, dest_filters in plan.items():
+        sources = resolve([source_filter])
+        if len(sources) > 1:
+            exit_with_error(
+                '[ERROR] More than one source machines!: {}'.format(
+                    list(x.hostname for x in sources)))
+        elif not sources:
+            exit_with_error('[ERROR] No source machine for {}!'.format(
+                source_filter))
+
+        source = sources[0]
+        destinations = [
+            d for d in resolve(dest_filters)
+            if d.system_id != source.system_id
+        ]
+        if not destinations:
+            exit_with_error('[ERROR] No destination machines for {}!'.format(
+                source.hostname))
+
+        for dest in destinations:
+            other = seen.setdefault(dest.system_id, source)
+            if other is not source:
+                exit_with_error(
+                    '[ERROR] {} is a destination of both {} and {}!'.format(
+                        dest.hostname, other.hostname, source.hostname))
+
+        resolved.append((source, destinations))
+
+    # clones run concurrently, so a source must not change while it is used
+    for source, _ in resolved:
+        other = seen.get(source.system_id)
+        if other is not None:
+            exit_with_error(
+                '[ERROR] {} is a source, and a destination of {}!'.format(
+                    source.hostname, other.hostname))
+
+    return resolved
 
 
 def clone_config(args):
     """Clones MaaS machines configuration"""
-    sources = query_machines(args.source)
-    if len(sources) > 1:
-        exit_with_error('[ERROR] More than one source machines!: {}'.format(
-            list(x.hostname for x in sources)))
-    elif not sources:
-        exit_with_error('[ERROR] No source machine!')
-
-    destinations = query_machines(args.destinations)
-    if not destinations:
-        exit_with_error('[ERROR] No destination machines!')
+    if args.plan:
+        plan = load_plan(args.plan)
+    else:
+        plan = {args.source: args.destinations}
 
-    source = sources[0]
+    resolved = resolve_plan(plan)
 
-    print('Will clone configuration from {} ({}) to:'.format(
-        source.system_id, source.hostname
-    ))
-    for dest in destinations:
-        print('* {} ({})'.format(dest.system_id, dest.hostname))
+    for source, destinations in resolved:
+        print('Will clone configuration from {} ({}) to:'.format(
+            source.system_id, source.hostname
+        ))
+        for dest in destinations:
+            print('* {} ({})'.format(dest.system_id, dest.hostname))
 
     if not args.force:
         re = input('Are you sure [y/N]? ')
         if re.lower() != 'y':
             exit_with_error('[ERROR] Aborted!')
 
-    try:
-        session().Machines.clone(
+    def clone(item):
+        source, destinations = item
+        return session().Machines.clone(
             source=source.system_id,
             destinations=[x.system_id for x in destinations],
             interfaces=args.interfaces,
             storage=args.storage
         )
 
-    except MaaSError as e:
-        exit_with_error('[ERROR] MaaS: {} {}'.format(e.status, e.content))
+    items = [
+        (source, chunk)
+        for source, destinations in resolved
+        for chunk in chunks(destinations, args.chunk_size)
+    ]
+
+    started = time.monotonic()
+    failed = 0
+    for (source, chunk), _, e in run_parallel(
+            clone, items, args.jobs, args.rate, args.retries):
+        hostnames = ', '.join(x.hostname for x in chunk)
+        if e is not None:
+            failed += 1
+            print('[{}] [ERROR] MaaS: {} {} ({})'.format(
+                source.hostname, getattr(e, 'status', ''),
+                getattr(e, 'content', e), hostnames))
+        else:
+            print('[{}] [OK] Cloned to {}'.format(source.hostname, hostnames))
+
+    print_summary(len(items) - failed, failed, started)
+    if failed:
+        exit_with_error('[ERROR] {} chunks failed.'.format(failed))
 
 
 def main():
@@ -79,18 +210,35 @@ def main():
     parser = argparse.ArgumentParser(
         description='Clone MaaS machines configuration')
 
-    parser.add_argument('--source', type=str, required=True,
+    parser.add_argument('--source', type=str,
                         help='Source machine')
-    parser.add_argument('--destinations', type=str, required=True, nargs='+',
+    parser.add_argument('--destinations', type=str, nargs='+',
                         help='Destination machines')
+    parser.add_argument('--plan', type=str,
+                        help='JSON/YAML file mapping sources to destinations')
     parser.add_argument('--interfaces', action='store_true', default=False,
                         help='Clone network interfaces configuration')
     parser.add_argument('--storage', action='store_true', default=False,
                         help='Clone storage configuration')
     parser.add_argument('--force', action='store_true', default=False,
                         help='Do not ask for confirmation')
-
-    clone_config(args=parser.parse_args())
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='Destinations per MaaS request')
+    parser.add_argument('--jobs', type=int, default=Config.jobs,
+                        help='Number of concurrent MaaS requests')
+    parser.add_argument('--rate', type=float, default=Config.rate,
+                        help='Maximum MaaS requests per second '
+                             '(0 means no limit)')
+    parser.add_argument('--retries', type=int, default=Config.retries,
+                        help='Number of retries for requests that fail '
+                             'with a transient error')
+
+    args = parser.parse_args()
+    if args.plan is None and (args.source is None or not args.destinations):
+        parser.error('either --plan or --source and --destinations '
+                     'are required')
+
+    clone_config(args)
 
 
 if __name__ == '__main__':
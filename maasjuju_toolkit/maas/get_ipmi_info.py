@@ -15,35 +15,48 @@
 
 """
 Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
-Last Update: 2019/10/17
+Last Update: 2026/10/17
 Description: Gets IPMI credentials of MaaS machine
 
 # Usage:
-$ mjt_get_ipmi_info [machine]
+$ mjt_get_ipmi_info [machine] [--ndjson]
 
 # Notes:
 * Machines can be matched using system id, hostname, domain name or tags.
   See `utils.py:query_machines()` for details.
+* With "--ndjson", one JSON object per machine is printed (including the
+  "fqdn"), as machines are read from the database.
 """
 
 import argparse
 import json
 
-from maasjuju_toolkit.util import query_machines
+from maasjuju_toolkit.util import (
+    query_machines, resolve_machines, daemon_call, print_ndjson)
 
 
-def get_ipmi_info(machines):
-    """returns IPMI credentials for a list of machines"""
+def ipmi_info(row):
+    """returns IPMI credentials of machine @row"""
     return {
-        row.fqdn: {
-            'power_address': row.power_address,
-            'power_pass': row.power_pass,
-            'power_user': row.power_user,
-            'system_id': row.system_id
-        } for row in query_machines(machines)
+        'power_address': row.power_address,
+        'power_pass': row.power_pass,
+        'power_user': row.power_user,
+        'system_id': row.system_id
     }
 
 
+def get_ipmi_info(machines):
+    """returns IPMI credentials for a list of machines"""
+    return {row.fqdn: ipmi_info(row) for row in resolve_machines(machines)}
+
+
+def print_ipmi_info_ndjson(machines):
+    """prints IPMI credentials for a list of machines, one line per
+    machine. Machines are not kept in memory"""
+    for row in query_machines(machines).iterator():
+        print_ndjson(dict(fqdn=row.fqdn, **ipmi_info(row)))
+
+
 def main():
     """parses arguments and does work"""
     parser = argparse.ArgumentParser(
@@ -55,9 +68,23 @@ def main():
         nargs='+',
         help='Hostname, system id, domain, tags'
     )
+    parser.add_argument(
+        '--ndjson',
+        action='store_true',
+        help='Print one JSON object per line'
+    )
 
     args = parser.parse_args()
-    print(json.dumps(get_ipmi_info(args.machines), indent=4))
+
+    if args.ndjson:
+        print_ipmi_info_ndjson(args.machines)
+        return
+
+    info = daemon_call('get_ipmi_info', machines=args.machines)
+    if info is None:
+        info = get_ipmi_info(args.machines)
+
+    print(json.dumps(info, indent=4))
 
 
 if __name__ == '__main__':
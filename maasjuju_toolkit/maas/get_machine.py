@@ -15,39 +15,111 @@
 
 """
 Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
-Last Update: 2019/04/25
+Last Update: 2026/10/17
 Description: Gets machine info directly from MaaS
 
 # Usage:
-$ mjt_get_machine [system_id]
+$ mjt_get_machine [machine] [machine] [--max-age SECONDS] [--jobs N]
 
 # Notes
-* This script talks directly to the MaaS API, ignoring the local db
+* Machines can be matched using system id, hostname, domain name or tags.
+  See `utils.py:query_machines()` for details. Arguments that match no
+  machine are used as system ids (e.g. for machines that are not in the
+  local database).
+* Machine details are cached. Cached details that are older than
+  `--max-age` seconds (default 60, or `MJT_MACHINE_TTL`) are read again
+  from MaaS, concurrently. Use "--max-age 0" to always read from MaaS.
+  `mjt_refresh` and scripts that change machines update the cache too.
+* One JSON object is printed for a single machine, a JSON list otherwise.
 """
 
 import json
 import argparse
+from datetime import datetime
 
-from maasjuju_toolkit.util import session, exit_with_error, MaaSError
+import peewee
 
+from maasjuju_toolkit.client import session
+from maasjuju_toolkit.config import Config
+from maasjuju_toolkit.util import (
+    MachineDocument, resolve_machines, exit_with_error, run_parallel,
+    store_machine_documents)
 
-def get_machine(system_id):
+
+def read_machines(system_ids, max_age=None, jobs=None, errors=None):
+    """returns a dict of system id to complete machine details. Cached
+    details newer than @max_age seconds are used, others are read from
+    MaaS with up to @jobs concurrent requests and cached. Errors are
+    stored in @errors (if not None)"""
+    if max_age is None:
+        max_age = Config.machine_ttl
+
+    now = datetime.now()
+    machines = {}
+    for ids in peewee.chunked(system_ids, 100):
+        for row in MachineDocument.select().where(
+                MachineDocument.system_id.in_(ids)):
+            if (now - row.timestamp).total_seconds() <= max_age:
+                machines[row.system_id] = json.loads(row.document)
+
+    def read(system_id):
+        return session().Machine.read(system_id=system_id)
+
+    missing = [x for x in system_ids if x not in machines]
+    fresh = []
+    for system_id, m, error in run_parallel(read, missing, jobs):
+        if error is not None:
+            if errors is not None:
+                errors[system_id] = error
+            continue
+
+        fresh.append(m)
+        machines[system_id] = m
+
+    store_machine_documents(fresh)
+    return machines
+
+
+def get_machine(machines, max_age=None, jobs=None):
     """asks MaaS for information and print it out"""
 
-    try:
-        m = session().Machine.read(system_id=system_id)
-    except MaaSError as e:
-        exit_with_error('[{}] [ERROR] {}'.format(system_id, e))
+    if not machines:
+        exit_with_error('[ERROR] You did not specify any machines.')
 
-    print(json.dumps({
-        'system_id': system_id,
-        'ip_addresses': ','.join(m['ip_addresses']),
-        'tags': ','.join(m['tag_names']),
-        'hostname': m['hostname'],
-        'domain': m['domain']['name'],
-        'fqdn': m['fqdn'],
-        'status': m['status_name']
-    }, indent=2))
+    # filters that match no cached machine are used as system ids
+    system_ids, seen = [], set()
+    for machine_filter in machines:
+        matched = [r.system_id for r in resolve_machines([machine_filter])]
+        for system_id in matched or [machine_filter]:
+            if system_id not in seen:
+                seen.add(system_id)
+                system_ids.append(system_id)
+
+    errors = {}
+    details = read_machines(system_ids, max_age, jobs, errors)
+    for system_id, e in errors.items():
+        print('[{}] [ERROR] {}'.format(system_id, e))
+
+    output = [
+        {
+            'system_id': system_id,
+            'ip_addresses': ','.join(m['ip_addresses']),
+            'tags': ','.join(m['tag_names']),
+            'hostname': m['hostname'],
+            'domain': m['domain']['name'],
+            'fqdn': m['fqdn'],
+            'status': m['status_name']
+        }
+        for system_id, m in
+        ((x, details[x]) for x in system_ids if x in details)
+    ]
+
+    if output:
+        print(json.dumps(
+            output[0] if len(system_ids) == 1 else output, indent=2))
+
+    if errors:
+        exit_with_error('[ERROR] Failed for {} machines'.format(len(errors)))
 
 
 def main():
@@ -56,12 +128,24 @@ def main():
         description='Get machine details directly from MaaS'
     )
     parser.add_argument(
-        'system_id',
+        'machines',
         type=str,
+        nargs='+',
+        help='Hostname, system id, domain, tags'
+    )
+    parser.add_argument(
+        '--max-age',
+        type=int,
+        default=Config.machine_ttl,
+        help='Maximum age (in seconds) of cached machine details'
+    )
+    parser.add_argument(
+        '--jobs', type=int, default=Config.jobs,
+        help='Number of concurrent MaaS requests'
     )
 
     args = parser.parse_args()
-    get_machine(args.system_id)
+    get_machine(args.machines, args.max_age, args.jobs)
 
 
 if __name__ == '__main__':
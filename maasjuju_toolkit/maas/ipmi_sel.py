@@ -15,45 +15,235 @@
 
 """
 Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
-Last Update: 2019/05/05
+Last Update: 2026/10/17
 Description: Manages IPMI System Event Log using machine info from MaaS
 
 # Usage:
-$ mjt_ipmi_sel list [machine] [[machine] ...]
-$ mjt_ipmi_sel clear [machine] [[machine] ...]
+$ mjt_ipmi_sel list [machine] [[machine] ...] [--jobs N] [--timeout T]
+$ mjt_ipmi_sel clear [machine] [[machine] ...] [--jobs N] [--timeout T]
+$ mjt_ipmi_sel collect [machine] [[machine] ...] [--full]
+$ mjt_ipmi_sel history [machine] [[machine] ...] [--days D] [--type TYPE]
+                       [--match TEXT]
 
 # Notes:
 * Machines can be matched using system id, hostname, domain name or tags.
   See `utils.py:query_machines()` for details.
 * "clear" is a destructive operation
+* Up to N BMCs are contacted at the same time (default: 8, or the MJT_JOBS
+  environment variable). The output of each BMC is printed as soon as it
+  completes. BMCs that do not respond within T seconds (default: 30, or the
+  MJT_IPMI_TIMEOUT environment variable) are skipped.
+* "collect" stores SEL records in the local database. Only records newer
+  than the last collected one are retrieved from each BMC. If the SEL of a
+  machine is cleared without using mjt_ipmi_sel, use "--full".
+* "history" prints collected SEL records from the local database, without
+  contacting any BMC. For example, all power supply events of machines
+  with tag "rack1" during the last week:
+
+    $ mjt_ipmi_sel history rack1 --days 7 --type "Power Supply"
 """
 
 import argparse
+from datetime import datetime, timedelta
 import subprocess
 
-from maasjuju_toolkit.util import query_machines, exit_with_error
+import peewee
 
+from maasjuju_toolkit.config import Config
+from maasjuju_toolkit.util import (
+    query_machines, resolve_machines, exit_with_error, run_parallel, db,
+    MaaSCache, SelEvent, SelState)
 
-def ipmi_sel(cmd, machines):
-    """lists or clear SEL of @machines"""
+# Last possible SEL record ID, used for incremental collection
+MAX_RECORD_ID = 65535
 
-    results = query_machines(machines)
+# Date and time format of ipmi-sel output
+SEL_DATE_FORMAT = '%b-%d-%Y %H:%M:%S'
+
+
+def run_ipmi_sel(row, timeout, args=()):
+    """runs ipmi-sel for the BMC of machine @row, with extra
+    command line @args. Returns an `(output, error)` tuple. `error` is
+    None if ipmi-sel succeeded"""
+    command_line = [
+        'ipmi-sel', '-h', row.power_address,
+        '-u', row.power_user, '-p', row.power_pass
+    ] + list(args)
+
+    try:
+        result = subprocess.run(
+            command_line, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, timeout=timeout)
+
+    except subprocess.TimeoutExpired:
+        return '', 'No response after {} seconds'.format(timeout)
+
+    except OSError as e:
+        return '', 'Could not run ipmi-sel: {}'.format(e)
+
+    if result.returncode != 0:
+        return '', (result.stdout.strip()
+                    or 'ipmi-sel exited with code {}'.format(
+                        result.returncode))
+
+    return result.stdout, None
+
+
+def parse_sel(output):
+    """parses ipmi-sel output and returns a list of records. Other lines
+    (headers, error messages) are ignored. Records without a valid date
+    have a `timestamp` of None"""
+    records = []
+    for line in output.splitlines():
+        fields = [f.strip() for f in line.split('|', 5)]
+        if len(fields) != 6:
+            continue
+
+        try:
+            record_id = int(fields[0])
+        except ValueError:
+            continue
+
+        try:
+            timestamp = datetime.strptime(
+                '{} {}'.format(fields[1], fields[2]), SEL_DATE_FORMAT)
+        except ValueError:
+            timestamp = None
+
+        records.append(dict(
+            record_id=record_id,
+            timestamp=timestamp,
+            name=fields[3],
+            type=fields[4],
+            event=fields[5]
+        ))
+
+    return records
+
+
+def ipmi_sel(cmd, machines, jobs=None, timeout=None):
+    """lists or clear SEL of @machines, contacting up to @jobs BMCs
+    at the same time"""
+    if timeout is None:
+        timeout = Config.ipmi_timeout
+
+    results = resolve_machines(machines)
     if not results:
         exit_with_error('[INFO] No matching machines found.')
 
-    # update machines, one by one
-    for r in results:
+    args = ['--clear'] if cmd == 'clear' else []
+
+    def run(row):
+        return run_ipmi_sel(row, timeout, args)
+
+    cleared = []
+    for r, (output, error), _ in run_parallel(run, results, jobs):
         print('## [{}] [{}]'.format(r.system_id, r.hostname))
+        print(output, end='', flush=True)
+
+        if error is not None:
+            print('[ERROR] {}'.format(error), flush=True)
+        else:
+            cleared.append(r.system_id)
+
+    # record ids start over after clearing the SEL
+    if cmd == 'clear':
+        for ids in peewee.chunked(cleared, 100):
+            SelState.update(last_record_id=0).where(
+                SelState.system_id.in_(ids)).execute()
+
+
+def collect_sel(machines, jobs=None, timeout=None, full=False):
+    """stores new SEL records of @machines in the local database. Only
+    records after the last collected one are requested, unless @full
+    is set"""
+    if timeout is None:
+        timeout = Config.ipmi_timeout
+
+    results = resolve_machines(machines)
+    if not results:
+        exit_with_error('[INFO] No matching machines found.')
 
-        command_line = [
-            'ipmi-sel', '-h', r.power_address,
-            '-u', r.power_user, '-p', r.power_pass
+    last = {}
+    if not full:
+        last = {s.system_id: s.last_record_id for s in SelState.select()}
+
+    def collect(row):
+        args = ['--no-header-output']
+        if last.get(row.system_id):
+            args.append('--range={}-{}'.format(
+                last[row.system_id] + 1, MAX_RECORD_ID))
+
+        output, error = run_ipmi_sel(row, timeout, args)
+        return parse_sel(output), error
+
+    for r, (records, error), _ in run_parallel(collect, results, jobs):
+        if error is not None:
+            print('[{}] [{}] [ERROR] {}'.format(
+                r.system_id, r.hostname, error))
+            continue
+
+        records = [
+            x for x in records if x['record_id'] > last.get(r.system_id, 0)
         ]
+        if full:
+            # the whole SEL is read again, skip records we already have
+            known = {
+                (e.record_id, e.timestamp, e.name, e.type, e.event)
+                for e in SelEvent.select().where(
+                    SelEvent.system_id == r.system_id)
+            }
+            records = [
+                x for x in records if (
+                    x['record_id'], x['timestamp'], x['name'], x['type'],
+                    x['event']) not in known
+            ]
+
+        print('[{}] [{}] [OK] {} new records'.format(
+            r.system_id, r.hostname, len(records)))
+
+        if not records:
+            continue
+
+        with db.atomic():
+            for chunk in peewee.chunked(records, 100):
+                SelEvent.insert_many(
+                    [dict(x, system_id=r.system_id) for x in chunk]).execute()
 
-        if cmd == 'clear':
-            command_line.append('--clear')
+            SelState.insert(
+                system_id=r.system_id,
+                last_record_id=max(x['record_id'] for x in records),
+                timestamp=datetime.now()
+            ).on_conflict_replace().execute()
 
-        subprocess.run(command_line)
+
+def sel_history(machines, days=None, event_type=None, match=None):
+    """prints collected SEL records of @machines, optionally only for
+    the last @days, of type @event_type, or containing @match"""
+    results = query_machines(machines)
+    hostnames = {r.system_id: r.hostname for r in results}
+    if not hostnames:
+        exit_with_error('[INFO] No matching machines found.')
+
+    events = SelEvent.select().where(
+        SelEvent.system_id.in_(results.select(MaaSCache.system_id)))
+
+    if days is not None:
+        events = events.where(
+            SelEvent.timestamp >= datetime.now() - timedelta(days=days))
+    if event_type is not None:
+        events = events.where(SelEvent.type == event_type)
+    if match is not None:
+        events = events.where(
+            SelEvent.name.contains(match)
+            | SelEvent.type.contains(match)
+            | SelEvent.event.contains(match))
+
+    for e in events.order_by(SelEvent.timestamp, SelEvent.record_id):
+        print(' | '.join(str(x) for x in [
+            hostnames[e.system_id], e.record_id, e.timestamp, e.name,
+            e.type, e.event
+        ]))
 
 
 def main():
@@ -64,7 +254,7 @@ def main():
     )
     parser.add_argument(
         'command',
-        choices=['list', 'clear'],
+        choices=['list', 'clear', 'collect', 'history'],
         help='Action'
     )
     parser.add_argument(
@@ -73,9 +263,50 @@ def main():
         nargs='*',
         help='Hostname, system id, domain, tags'
     )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=Config.jobs,
+        help='Number of BMCs to contact at the same time'
+    )
+    parser.add_argument(
+        '--timeout',
+        type=int,
+        default=Config.ipmi_timeout,
+        help='Seconds to wait for each BMC'
+    )
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        default=False,
+        help='collect: Retrieve all SEL records, not only new ones'
+    )
+    parser.add_argument(
+        '--days',
+        type=float,
+        default=None,
+        help='history: Only show records of the last DAYS days'
+    )
+    parser.add_argument(
+        '--type',
+        type=str,
+        default=None,
+        help='history: Only show records of this sensor type'
+    )
+    parser.add_argument(
+        '--match',
+        type=str,
+        default=None,
+        help='history: Only show records that contain this text'
+    )
 
     args = parser.parse_args()
-    ipmi_sel(args.command, args.machines)
+    if args.command == 'collect':
+        collect_sel(args.machines, args.jobs, args.timeout, args.full)
+    elif args.command == 'history':
+        sel_history(args.machines, args.days, args.type, args.match)
+    else:
+        ipmi_sel(args.command, args.machines, args.jobs, args.timeout)
 
 
 if __name__ == '__main__':
@@ -15,7 +15,7 @@
 
 """
 Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
-Last Update: 2019/10/17
+Last Update: 2026/10/17
 Description: Lists and suppresses/deletes MaaS machine script results from
              Commissioning and Hardware Tests.
 
@@ -33,7 +33,13 @@ Description: Lists and suppresses/deletes MaaS machine script results from
 
     $ mjt_script_results list [machine] [machine] [--no-installation]
         [--no-commission] [--no-tests] [--no-aborted] [--no-skipped]
-        [--no-passed]
+        [--no-passed] [--jobs N] [--ndjson]
+
+* Script results of many machines are retrieved concurrently, using up to
+  N parallel requests (default: 8, or the MJT_JOBS environment variable).
+
+* With "--ndjson", results are printed as soon as they are retrieved, one
+  JSON object (`{"system_id": ..., "results": ...}`) per line.
 
 * Suppresses/deletes script results based on category/status. "Passed" scripts
   are always ignored. If no [machine] is given, the script will run for all
@@ -48,6 +54,21 @@ Description: Lists and suppresses/deletes MaaS machine script results from
     $ mjt_script_results delete [machine] [--no-commission]
         [--no-tests] [--no-aborted] [--no-skipped]
 
+* Updates the local cache of script results, which is used by the
+  mjt_check_script_results Nagios plugin. Run this periodically from cron.
+  If no <machine> is passed, the script will run for all known machines.
+  Suppressing or deleting script results removes the cached results of the
+  affected machines, so the plugin reads them from MaaS again.
+
+    $ mjt_script_results refresh [machine] [machine] [--jobs N]
+
+* Bulk suppress/unsuppress/delete operations run concurrently as well.
+  Use "--rate R" to send at most R requests per second, and "--retries N"
+  to retry requests that fail with a transient MaaS error. Failed requests
+  are printed, followed by a summary.
+
+    $ mjt_script_results delete --jobs 16 --rate 50 --retries 5
+
 * Suppresses/deletes individual script ids for a machine.
 
     $ mjt_script_results suppress_id [machine] [--script-id script_id]
@@ -56,58 +77,237 @@ Description: Lists and suppresses/deletes MaaS machine script results from
 """
 
 import argparse
+from datetime import datetime
 import json
+import sys
+import time
+
+import peewee
 
+from maasjuju_toolkit.config import Config
 from maasjuju_toolkit.util import (
-    exit_with_error, session, MaaSError, query_machines)
+    exit_with_error, resolve_machines, run_parallel, print_summary, db,
+    ScriptResultsCache, daemon_call, print_ndjson)
+
+# NOTE: the MaaS client (maasjuju_toolkit.client) is imported only when
+# needed, so that the Nagios plugin can use cached results without loading
+# it.
 
 ##################################################################
 
 
-def get_script_results(machine, skip):
-    """returns all script group results, along with result status"""
+def summarize_script_results(scripts, skip):
+    """returns a summary of the script results of a single machine,
+    ignoring script types and statuses that are in @skip"""
+    results = {}
+    for s in scripts:
+        if s['type_name'] in skip or s['status_name'] in skip:
+            continue
+
+        suppressed = [r for r in s['results'] if r['suppressed']]
+        ids = ','.join([str(r['id']) for r in s['results']])
+        results[s['id']] = {
+            'type': s['type_name'],
+            'status': s['status_name'],
+            'total': len(s['results']),
+            'suppressed': len(suppressed),
+            'individual_ids': ids
+        }
+
+    return results
+
+
+def _select_machines(machine):
+    """returns matching machines for @machine, which can be a
+    single filter or a list of filters. Exits with UNKNOWN if no
+    machines match"""
 
     if isinstance(machine, str):
         query = [machine]
     else:
         query = machine
 
-    machines = query_machines(query)
+    machines = resolve_machines(query)
     if not machines:
         exit_with_error(
             'UNKNOWN: No matching machine: {}'.format(machine), code=3)
 
+    return machines
+
+
+def iter_script_results(system_ids, skip, jobs=None, errors=None):
+    """retrieves script results for @system_ids from MaaS, using up to
+    @jobs concurrent requests. Yields `(system_id, summary)` tuples as
+    soon as the results of each machine are retrieved. Machines for which
+    MaaS returns an error are left out, and the error is added in the
+    @errors dict (if given) or printed"""
+    from maasjuju_toolkit.client import session
     api = session()
 
+    def read(system_id):
+        return api.NodeScriptResults.read(system_id=system_id)
+
+    for system_id, scripts, error in run_parallel(read, system_ids, jobs):
+        if error is not None:
+            if errors is None:
+                print('[{}] [ERROR] MaaS: {}'.format(system_id, error),
+                      file=sys.stderr)
+            else:
+                errors[system_id] = error
+
+            continue
+
+        yield system_id, summarize_script_results(scripts, skip)
+
+
+def fetch_script_results(system_ids, skip, jobs=None, errors=None):
+    """same as `iter_script_results()`, but returns a summary for every
+    machine, in the order of @system_ids"""
+    summaries = dict(iter_script_results(system_ids, skip, jobs, errors))
+
+    return {
+        system_id: summaries[system_id]
+        for system_id in system_ids if system_id in summaries
+    }
+
+
+def get_script_results(machine, skip, jobs=None, errors=None):
+    """returns all script group results, along with result status.
+    Script results are retrieved using up to @jobs concurrent requests.
+    See `fetch_script_results()` for error handling"""
+
+    machines = _select_machines(machine)
+    results = fetch_script_results(
+        [m.system_id for m in machines], skip, jobs, errors)
+
+    return {k: v for k, v in results.items() if v}
+
+
+##################################################################
+
+
+def cache_script_results(results):
+    """stores script results summaries in the local database"""
+    now = datetime.now()
+    rows = [
+        dict(system_id=system_id, results=json.dumps(summary), timestamp=now)
+        for system_id, summary in results.items()
+    ]
+
+    with db.atomic():
+        for chunk in peewee.chunked(rows, 100):
+            ScriptResultsCache.insert_many(chunk).on_conflict_replace() \
+                .execute()
+
+
+def invalidate_script_results(system_ids):
+    """removes cached script results of @system_ids, e.g. after changing
+    them, so that the Nagios plugin does not report outdated results"""
+    with db.atomic():
+        for ids in peewee.chunked(list(system_ids), 100):
+            ScriptResultsCache.delete().where(
+                ScriptResultsCache.system_id.in_(ids)).execute()
+
+
+def refresh_script_results(machine, jobs=None):
+    """retrieves script results for @machine from MaaS and updates the
+    local cache. Meant to run periodically (e.g. from cron), so that
+    `get_cached_script_results()` does not need to contact MaaS"""
+
+    machines = _select_machines(machine)
+    results = fetch_script_results(
+        [m.system_id for m in machines], skip=set(), jobs=jobs)
+
+    cache_script_results(results)
+    print('Cached script results for {} machines'.format(len(results)))
+
+
+def get_cached_script_results(machine, skip, max_age=None, jobs=None,
+                              errors=None):
+    """same as `get_script_results()`, but uses cached script results
+    that are newer than @max_age seconds. Results of other machines are
+    retrieved from MaaS and cached. Returns the results, along with the
+    age (in seconds) of the oldest cached entry used"""
+    if max_age is None:
+        max_age = Config.script_results_ttl
+
+    machines = _select_machines(machine)
+    system_ids = [m.system_id for m in machines]
+
+    now = datetime.now()
+    cached = {}
+    for ids in peewee.chunked(system_ids, 100):
+        for row in ScriptResultsCache.select().where(
+                ScriptResultsCache.system_id.in_(ids)):
+            age = (now - row.timestamp).total_seconds()
+            if age <= max_age:
+                cached[row.system_id] = (
+                    {int(k): v for k, v in json.loads(row.results).items()},
+                    age)
+
+    missing = [x for x in system_ids if x not in cached]
+    if missing:
+        fresh = fetch_script_results(missing, set(), jobs, errors)
+        cache_script_results(fresh)
+        cached.update({k: (v, 0) for k, v in fresh.items()})
+
     results = {}
-    for m in machines:
-        scripts = api.NodeScriptResults.read(system_id=m.system_id)
-        for s in scripts:
-            if s['type_name'] in skip or s['status_name'] in skip:
-                continue
-
-            if m.system_id not in results:
-                results[m.system_id] = {}
-
-            suppressed = [r for r in s['results'] if r['suppressed']]
-            ids = ','.join([str(r['id']) for r in s['results']])
-            results[m.system_id].update({
-                s['id']: {
-                    'type': s['type_name'],
-                    'status': s['status_name'],
-                    'total': len(s['results']),
-                    'suppressed': len(suppressed),
-                    'individual_ids': ids
-                }
-            })
+    for system_id in system_ids:
+        if system_id not in cached:
+            continue
 
-    return results
+        summary = {
+            script_id: r for script_id, r in cached[system_id][0].items()
+            if r['type'] not in skip and r['status'] not in skip
+        }
+        if summary:
+            results[system_id] = summary
+
+    age = max([age for _, age in cached.values()], default=0)
+    return results, age
 
 
 ##################################################################
 
 
-def set_suppressed(machines, skip, suppressed):
+def bulk_update(all_results, update, jobs=None, rate=None, retries=None):
+    """calls update(system_id, script_id) for all script results in
+    @all_results, using up to @jobs concurrent requests and at most
+    @rate requests per second. Requests that fail with a transient error
+    are retried up to @retries times. Prints failed requests and a
+    summary at the end"""
+    if rate is None:
+        rate = Config.rate
+    if retries is None:
+        retries = Config.retries
+
+    pairs = [
+        (system_id, script_id)
+        for system_id, machine_results in all_results.items()
+        for script_id in machine_results
+    ]
+
+    def call(pair):
+        return update(*pair)
+
+    started = time.monotonic()
+    failed = 0
+    try:
+        for pair, _, error in run_parallel(
+                call, pairs, jobs, rate, retries):
+            if error is not None:
+                failed += 1
+                print('[{}] Failed for script {}: {}: {}'.format(
+                    pair[0], pair[1], error.__class__.__name__, error))
+
+    finally:
+        invalidate_script_results(all_results)
+
+    print_summary(len(pairs) - failed, failed, started)
+
+
+def set_suppressed(machines, skip, suppressed, jobs=None, rate=None,
+                   retries=None):
     """for a list of @machines, updates script results with
     status other than 'Passed' and sets the `suppressed`
     property to @suppressed"""
@@ -121,17 +321,23 @@ def set_suppressed(machines, skip, suppressed):
     if not suppressed:
         skip -= {'Passed'}
 
-    all_results = get_script_results(machines, skip)
+    from maasjuju_toolkit.client import session
+    all_results = get_script_results(machines, skip, jobs)
+    api = session()
+
+    def update(system_id, script_id):
+        api.NodeScriptResult.update(
+            system_id=system_id, id=script_id, suppressed=suppressed)
 
-    for system_id, machine_results in all_results.items():
-        for script_id in machine_results:
-            set_suppressed_id(system_id, script_id, suppressed)
+    print('Setting suppressed={} for script results'.format(suppressed))
+    bulk_update(all_results, update, jobs, rate, retries)
 
 
 def set_suppressed_id(system_id, script_id, suppressed):
     """updates @script_id for @system_id and sets `suppressed`
     property to @suppressed. Prints a helpful error message
     if that failed."""
+    from maasjuju_toolkit.client import session, MaaSError
 
     try:
         session().NodeScriptResult.update(
@@ -144,23 +350,30 @@ def set_suppressed_id(system_id, script_id, suppressed):
         print('[{}] Failed to set suppressed={} for script {}: {}: {}'.format(
             system_id, suppressed, script_id, e.__class__.__name__, e))
 
+    invalidate_script_results([system_id])
+
 
-def delete_results(machines, skip):
+def delete_results(machines, skip, jobs=None, rate=None, retries=None):
     """for a list of @machines, deletes script results where
     status != 'Passed'"""
 
     # "installation" and "passed" results are always ignored
     skip = skip | {'Passed'}
 
-    all_results = get_script_results(machines, skip)
+    from maasjuju_toolkit.client import session
+    all_results = get_script_results(machines, skip, jobs)
+    api = session()
+
+    def delete(system_id, script_id):
+        api.NodeScriptResult.delete(system_id=system_id, id=script_id)
 
-    for system_id, machine_results in all_results.items():
-        for script_id in machine_results:
-            delete_result_id(system_id, script_id)
+    print('Deleting script results')
+    bulk_update(all_results, delete, jobs, rate, retries)
 
 
 def delete_result_id(system_id, script_id):
     """deletes results of @script_id for @system_id"""
+    from maasjuju_toolkit.client import session, MaaSError
 
     try:
         session().NodeScriptResult.delete(
@@ -172,16 +385,40 @@ def delete_result_id(system_id, script_id):
         print('[{}] Failed to delete script {}: {}: {}'.format(
             system_id, script_id, e.__class__.__name__, e))
 
+    invalidate_script_results([system_id])
+
 ##################################################################
 
 
-def script_results(command, machine, script_id, skip):
+def script_results(command, machine, script_id, skip, jobs=None, rate=None,
+                   retries=None, ndjson=False):
     """calls appropriate command"""
-    if command == 'list':
-        print(json.dumps(get_script_results(machine, skip), indent=2))
+    if command == 'list' and ndjson:
+        machines = _select_machines(machine)
+        for system_id, summary in iter_script_results(
+                [m.system_id for m in machines], skip, jobs):
+            if summary:
+                print_ndjson({'system_id': system_id, 'results': summary})
+
+    elif command == 'list':
+        response = daemon_call(
+            'script_results', machines=machine, skip=list(skip), jobs=jobs)
+        if response is None:
+            results = get_script_results(machine, skip, jobs)
+        else:
+            results = response['results']
+            for system_id, error in response['errors'].items():
+                print('[{}] [ERROR] MaaS: {}'.format(system_id, error),
+                      file=sys.stderr)
+
+        print(json.dumps(results, indent=2))
+
+    elif command == 'refresh':
+        refresh_script_results(machine, jobs)
 
     elif command in ['suppress', 'unsuppress']:
-        set_suppressed(machine, skip, bool(command == 'suppress'))
+        set_suppressed(
+            machine, skip, bool(command == 'suppress'), jobs, rate, retries)
 
     elif command in ['suppress_id', 'unsuppress_id']:
         if machine == '':
@@ -192,7 +429,7 @@ def script_results(command, machine, script_id, skip):
         set_suppressed_id(machine, script_id, bool(command == 'suppress_id'))
 
     elif command == 'delete':
-        delete_results(machine, skip)
+        delete_results(machine, skip, jobs, rate, retries)
 
     elif command == 'delete_id':
         delete_result_id(machine, script_id)
@@ -210,7 +447,7 @@ def main():
     )
     parser.add_argument(
         'command',
-        choices=['list', 'suppress', 'delete', 'unsuppress',
+        choices=['list', 'refresh', 'suppress', 'delete', 'unsuppress',
                  'suppress_id', 'delete_id', 'unsuppress_id'],
         help='What to do'
     )
@@ -220,6 +457,24 @@ def main():
     parser.add_argument(
         '--script-id', type=str
     )
+    parser.add_argument(
+        '--jobs', type=int, default=Config.jobs,
+        help='Number of concurrent MaaS requests'
+    )
+    parser.add_argument(
+        '--rate', type=float, default=Config.rate,
+        help='Maximum MaaS requests per second when updating results '
+             '(0 means no limit)'
+    )
+    parser.add_argument(
+        '--retries', type=int, default=Config.retries,
+        help='Number of retries for requests that fail with a '
+             'transient error'
+    )
+    parser.add_argument(
+        '--ndjson', action='store_true',
+        help='List results as they are retrieved, one JSON object per line'
+    )
     for x in ['Installation', 'Passed', 'Commissioning',
               'Testing', 'Skipped', 'Aborted']:
         parser.add_argument(
@@ -241,7 +496,9 @@ def main():
     if args.command.endswith('_id') and args.script_id is None:
         exit_with_error('[ERROR] No script id passed')
 
-    script_results(args.command, args.machines, args.script_id, skip)
+    script_results(
+        args.command, args.machines, args.script_id, skip, args.jobs,
+        args.rate, args.retries, args.ndjson)
 
 ##################################################################
 
@@ -15,34 +15,106 @@
 
 """
 Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
-Last Update: 2019/05/02
+Last Update: 2026/10/17
 Description: Updates domain names of MaaS machines
 
 # Usage:
 $ mjt_update_domain_name [machine] [machine] [--new-domain new.domain.name]
+                         [--jobs N] [--rate R] [--retries N]
+$ mjt_update_domain_name [machine] [machine] --new-domain new.domain.name \
+                         --failed
 
 # Notes:
 * Machines can be matched using system id, hostname, domain name or tags.
   See `utils.py:query_machines()` for details.
 * Domain will be automatically created if needed.
+* Machines are updated in parallel. A failure for one machine does not
+  affect the others.
+* Machines that are already in the new domain (according to the local
+  database) are skipped, so an interrupted or partially failed run can
+  simply be started again.
+* The outcome for each machine is recorded in the local database. Use
+  "--failed" to retry only the machines that failed for this domain. Any
+  machine filters given along with "--failed" select among those machines.
+* The local database is updated with the changed machines.
 """
 
 import argparse
+from datetime import datetime
+import time
 
-from maasjuju_toolkit.util import (
-    query_machines, exit_with_error, session, MaaSError)
-
-
-def update_domain_name(machines, new_domain):
-    """updates domain name of machines"""
+import peewee
 
-    if not machines:
+from maasjuju_toolkit.client import session, MaaSError
+from maasjuju_toolkit.config import Config
+from maasjuju_toolkit.refresh import patch_machines
+from maasjuju_toolkit.util import (
+    db, DomainUpdate, MaaSCache, resolve_machines, exit_with_error,
+    print_summary, run_parallel)
+
+
+def failed_machines(domain):
+    """returns machines whose last update to @domain failed"""
+    return list(MaaSCache.select().where(MaaSCache.system_id.in_(
+        DomainUpdate.select(DomainUpdate.system_id).where(
+            (DomainUpdate.domain == domain) & (DomainUpdate.error != ''))
+    )).order_by(MaaSCache.fqdn))
+
+
+def record_outcomes(domain, outcomes):
+    """stores @outcomes (a dict of system id to error message, which is
+    empty on success) of updating machines to @domain"""
+    if not outcomes:
+        return
+
+    now = datetime.now()
+    rows = [
+        dict(timestamp=now, system_id=system_id, domain=domain, error=error)
+        for system_id, error in outcomes.items()
+    ]
+    with db.atomic():
+        for chunk in peewee.chunked(rows, 100):
+            DomainUpdate.insert_many(chunk).on_conflict_replace().execute()
+
+
+def update_domain_name(machines, new_domain, jobs=None, rate=None,
+                       retries=None, failed=False):
+    """updates domain name of machines. if @failed, only machines whose
+    last update to @new_domain failed are updated. @machines, if any,
+    narrow these down further"""
+    if rate is None:
+        rate = Config.rate
+    if retries is None:
+        retries = Config.retries
+
+    if failed:
+        results = failed_machines(new_domain)
+        if machines:
+            selected = {r.system_id for r in resolve_machines(machines)}
+            results = [r for r in results if r.system_id in selected]
+
+    elif not machines:
         exit_with_error('[ERROR] You did not specify any machines.')
 
-    results = query_machines(machines)
+    else:
+        results = resolve_machines(machines)
+
     if not results:
         exit_with_error('[INFO] No matching machines found.')
 
+    # skip machines that are already in the new domain
+    todo = []
+    for r in results:
+        if r.domain == new_domain:
+            print('[{}] [{}] [INFO] Already in {}'.format(
+                r.system_id, r.hostname, new_domain))
+        else:
+            todo.append(r)
+
+    if not todo:
+        print('Done. All machines are already in {}.'.format(new_domain))
+        return
+
     try:
         # create domain name if needed
         all_domains = session().Domains.read()
@@ -56,18 +128,37 @@ def update_domain_name(machines, new_domain):
     except MaaSError as e:
         exit_with_error('[ERROR] MaaS: {}'.format(e))
 
-    # update machines, one by one
-    for r in results:
-        try:
-            session().Machine.update(system_id=r.system_id, domain=new_domain)
+    def update(r):
+        return session().Machine.update(
+            system_id=r.system_id, domain=new_domain)
+
+    # update machines in parallel
+    started = time.monotonic()
+    updated, outcomes = [], {}
+    try:
+        for r, result, error in run_parallel(
+                update, todo, jobs, rate, retries):
+            if error is not None:
+                outcomes[r.system_id] = str(error) or 'error'
+                print('[{}] [{}] [ERROR] MaaS: {}'.format(
+                    r.system_id, r.hostname, error))
+                continue
+
+            updated.append(result)
+            outcomes[r.system_id] = ''
             print('[{}] [{}] [OK] Set to {}'.format(
                 r.system_id, r.hostname, new_domain))
 
-        except MaaSError as e:
-            exit_with_error('[{}] [{}] [ERROR] MaaS: {}'.format(
-                r.system_id, r.hostname, e))
+    finally:
+        # write-through, also for the machines updated before any error
+        patch_machines(updated)
+        record_outcomes(new_domain, outcomes)
 
-    print('Done. Refresh machine list with "mjt_refresh".')
+    failed_count = len(outcomes) - len(updated)
+    print_summary(len(updated), failed_count, started)
+    if failed_count:
+        print('Retry failed machines with "mjt_update_domain_name '
+              '--new-domain {} --failed".'.format(new_domain))
 
 
 def main():
@@ -88,9 +179,28 @@ def main():
         required=True,
         help='New domain name for machines (will be created if needed)'
     )
+    parser.add_argument(
+        '--failed',
+        action='store_true',
+        help='Retry machines whose last update to this domain failed'
+    )
+    parser.add_argument(
+        '--jobs', type=int, default=Config.jobs,
+        help='Number of concurrent MaaS requests'
+    )
+    parser.add_argument(
+        '--rate', type=float, default=Config.rate,
+        help='Maximum MaaS requests per second (0 means no limit)'
+    )
+    parser.add_argument(
+        '--retries', type=int, default=Config.retries,
+        help='Number of retries for requests that fail with a '
+             'transient error'
+    )
 
     args = parser.parse_args()
-    update_domain_name(args.machines, args.new_domain)
+    update_domain_name(args.machines, args.new_domain, args.jobs,
+                       args.rate, args.retries, args.failed)
 
 
 if __name__ == '__main__':
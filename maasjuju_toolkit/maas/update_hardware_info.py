@@ -15,12 +15,13 @@
 
 """
 Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
-Last Update: 2019/05/15
+Last Update: 2026/10/17
 Description: Updates info for CPU cores and RAM of MaaS machines
 
 # Usage:
 $ mjt_update_hardware_info [machine] [machine]
                            [--new-cpus cpus] [--new-ram ram]
+                           [--jobs N] [--rate R] [--retries N] [--dry-run]
 
 # Notes:
 * Machines can be matched using system id, hostname, domain name or tags.
@@ -28,40 +29,96 @@ $ mjt_update_hardware_info [machine] [machine]
 * CPUS is number of CPU cores
 * RAM is available RAM (given in GB)
 * You cannot update hardware info for Deployed or Locked machines.
+* Machines whose CPU cores and RAM in the local database already match
+  are skipped. Use "--dry-run" to only print the changes.
+* Machines are updated in parallel. A failure for one machine does not
+  affect the others.
+* The local database is updated with the changed machines.
 """
 
 import argparse
+import time
 
+from maasjuju_toolkit.client import session
+from maasjuju_toolkit.config import Config
+from maasjuju_toolkit.refresh import patch_machines
 from maasjuju_toolkit.util import (
-    query_machines, exit_with_error, session, MaaSError)
+    resolve_machines, exit_with_error, print_summary, run_parallel)
 
 
-def update_hardware_info(machine, new_cpus, new_ram):
+def hardware_changes(row, new_cpus, new_ram):
+    """returns the MaaS fields that need to be updated for machine @row
+    (from the local database). Fields that already match are omitted"""
+    update = {}
+    if new_cpus is not None and row.cpus != new_cpus:
+        update['cpu_count'] = new_cpus
+
+    if new_ram is not None and row.ram != new_ram:
+        update['memory'] = new_ram * 1024
+
+    return update
+
+
+def update_hardware_info(machine, new_cpus, new_ram, jobs=None, rate=None,
+                         retries=None, dry_run=False):
     """updates cpus and ram of machines"""
 
-    results = query_machines(machine)
+    if new_cpus is None and new_ram is None:
+        exit_with_error('[ERROR] You did not specify --new-cpus/--new-ram.')
+
+    if rate is None:
+        rate = Config.rate
+    if retries is None:
+        retries = Config.retries
+
+    results = resolve_machines(machine)
     if not results:
         exit_with_error('[INFO] No matching machines found.')
 
-    # update machines, one by one
+    # skip machines that are already up to date
+    changes = {}
     for r in results:
-        try:
-            update = {}
-            if new_cpus is not None:
-                update['cpu_count'] = new_cpus
-
-            if new_ram is not None:
-                update['memory'] = new_ram * 1024
-
-            session().Machine.update(system_id=r.system_id, **update)
+        update = hardware_changes(r, new_cpus, new_ram)
+        if update:
+            changes[r.system_id] = update
+        else:
+            print('[{}] [{}] [INFO] Already up to date'.format(
+                r.system_id, r.hostname))
+
+    todo = [r for r in results if r.system_id in changes]
+    if dry_run:
+        for r in todo:
+            print('[{}] [{}] [DRY-RUN] Would update Hardware Info: {}'.format(
+                r.system_id, r.hostname, changes[r.system_id]))
+
+        print('Done. {} machines would be updated, {} skipped.'.format(
+            len(todo), len(results) - len(todo)))
+        return
+
+    def update(r):
+        return session().Machine.update(
+            system_id=r.system_id, **changes[r.system_id])
+
+    started = time.monotonic()
+    updated, failed = [], 0
+    try:
+        for r, result, error in run_parallel(
+                update, todo, jobs, rate, retries):
+            if error is not None:
+                failed += 1
+                print('[{}] [{}] [ERROR] MaaS: {}'.format(
+                    r.system_id, r.hostname, error))
+                continue
+
+            updated.append(result)
             print('[{}] [{}] [OK] Updated Hardware Info: {}'.format(
-                r.system_id, r.hostname, update))
+                r.system_id, r.hostname, changes[r.system_id]))
 
-        except MaaSError as e:
-            exit_with_error('[{}] [{}] [ERROR] MaaS: {}'.format(
-                r.system_id, r.hostname, e))
+    finally:
+        # write-through, also for the machines updated before any error
+        patch_machines(updated)
 
-    print('Done. Refresh machine list with "jmt_refresh".')
+    print_summary(len(updated), failed, started)
 
 
 def main():
@@ -90,9 +147,28 @@ def main():
         default=None,
         help='New value for machine RAM (in GB)'
     )
+    parser.add_argument(
+        '--jobs', type=int, default=Config.jobs,
+        help='Number of concurrent MaaS requests'
+    )
+    parser.add_argument(
+        '--rate', type=float, default=Config.rate,
+        help='Maximum MaaS requests per second (0 means no limit)'
+    )
+    parser.add_argument(
+        '--retries', type=int, default=Config.retries,
+        help='Number of retries for requests that fail with a '
+             'transient error'
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Only print the changes, do not update MaaS'
+    )
 
     args = parser.parse_args()
-    update_hardware_info(args.machine, args.new_cpus, args.new_ram)
+    update_hardware_info(args.machine, args.new_cpus, args.new_ram,
+                         args.jobs, args.rate, args.retries, args.dry_run)
 
 
 if __name__ == '__main__':
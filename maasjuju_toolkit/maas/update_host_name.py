@@ -15,7 +15,7 @@
 
 """
 Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
-Last Update: 2019/10/17
+Last Update: 2026/10/17
 Description: Updates hostname of a MaaS machine
 
 # Usage:
@@ -25,25 +25,28 @@ $ mjt_update_host_name [machine] [--new-hostname new_name]
 * Machines can be matched using system id, hostname, domain name or tags.
   See `utils.py:query_machines()` for details. If multiple machines match
   the query, only one of them will be changed.
+* The local database is updated with the changed machine.
 """
 
 import argparse
 
-from maasjuju_toolkit.util import (
-    query_machines, exit_with_error, session, MaaSError)
+from maasjuju_toolkit.client import session, MaaSError
+from maasjuju_toolkit.refresh import patch_machines
+from maasjuju_toolkit.util import resolve_machines, exit_with_error
 
 
 def update_host_name(machine, new_hostname):
     """updates host name of machine"""
 
-    results = query_machines([machine])
+    results = resolve_machines([machine])
     if not results:
         exit_with_error('[INFO] No matching machines found.')
 
     # update machines, one by one
     r = results[0]
     try:
-        session().Machine.update(system_id=r.system_id, hostname=new_hostname)
+        machine = session().Machine.update(
+            system_id=r.system_id, hostname=new_hostname)
         print('[{}] [{}] [OK] Updated hostname to {}'.format(
             r.system_id, r.hostname, new_hostname))
 
@@ -51,7 +54,8 @@ def update_host_name(machine, new_hostname):
         exit_with_error('[{}] [{}] [ERROR] MaaS: {}'.format(
             r.system_id, r.hostname, e))
 
-    print('Done. Refresh machine list with "mjt_refresh".')
+    patch_machines([machine])
+    print('Done.')
 
 
 def main():
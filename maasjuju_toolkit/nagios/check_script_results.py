@@ -15,16 +15,22 @@
 
 """
 Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
-Last Update: 2019/05/02
+Last Update: 2026/10/17
 Description: Nagios plugin that checks results of Commissioning
              and Hardware Tests on MaaS
 
 # Usage:
-$ mjt_check_script_results machine [machine]
+$ mjt_check_script_results machine [machine] [--max-age SECONDS]
 
 # Notes:
 * Machines can be matched using system id, hostname, domain name or tags.
   See `utils.py:query_machines()` for details.
+* Script results are read from the local cache, which should be updated
+  periodically with `mjt_script_results refresh`. Machines with cached
+  results older than --max-age seconds (default: 900, or the
+  MJT_SCRIPT_RESULTS_TTL environment variable) are checked against MaaS.
+  The age of the oldest cached results is reported as `cache_age`
+  performance data.
 
 # Output:
 OK == all machines are ok
@@ -35,20 +41,30 @@ CRITICAL == there are failed tests
 import argparse
 from collections import defaultdict
 import json
+import sys
 
-from maasjuju_toolkit.maas.script_results import get_script_results
-from maasjuju_toolkit.util import print_nagios
+from maasjuju_toolkit.config import Config
+from maasjuju_toolkit.maas.script_results import get_cached_script_results
+from maasjuju_toolkit.util import print_nagios, daemon_call
 
 
-def check_script_results(machines):
-    """checks script results and print proper nagios output"""
+def script_results_status(machines, max_age=None):
+    """checks script results, returns nagios output and perfdata (see
+    `print_nagios()`). Cached script results up to @max_age seconds old
+    are used"""
 
     output = {
         'ok': [], 'warning': [], 'critical': []
     }
 
     # will exit with "UNKNOWN" on error
-    results = get_script_results(machines, skip=set())
+    errors = {}
+    results, age = get_cached_script_results(
+        machines, skip=set(), max_age=max_age, errors=errors)
+    for system_id, error in errors.items():
+        output['warning'].append('{} could not be checked: {}'.format(
+            system_id, error))
+
     total_suppressed = 0
     for hostname, host_results in results.items():
         count = defaultdict(lambda: 0)
@@ -67,7 +83,12 @@ def check_script_results(machines):
         output[which].append('{} has {} tests'.format(
             hostname, json.dumps(count)))
 
-    print_nagios(output)
+    return output, {'cache_age': '{:.0f}s'.format(age)}
+
+
+def check_script_results(machines, max_age=None):
+    """checks script results and print proper nagios output"""
+    print_nagios(*script_results_status(machines, max_age))
 
 
 def main():
@@ -83,9 +104,22 @@ def main():
         nargs='+',
         help='MaaS machines to check'
     )
+    parser.add_argument(
+        '--max-age',
+        type=int,
+        default=Config.script_results_ttl,
+        help='Maximum age (in seconds) of cached script results'
+    )
 
     args = parser.parse_args()
-    check_script_results(args.machines)
+
+    response = daemon_call(
+        'check_script_results', machines=args.machines, max_age=args.max_age)
+    if response is not None:
+        print(response['text'])
+        sys.exit(response['exitcode'])
+
+    check_script_results(args.machines, args.max_age)
 
 
 if __name__ == '__main__':
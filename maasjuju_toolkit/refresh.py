@@ -15,19 +15,38 @@
 
 """
 Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
-Last Update: 2019/10/17
+Last Update: 2026/10/17
 Description: Refreshes local database of MaaS machines
 
 # Usage:
-$ mjt_refresh
+$ mjt_refresh [--incremental] [--reset-api]
 
 # Notes:
 * This process may take 2-3 minutes for big MaaS installations
+* With "--incremental", only machines whose data changed since the last
+  refresh are updated (power parameters are only retrieved for those).
+  Changes in power parameters alone are not detected, run a full refresh
+  every now and then.
+* Machines that no longer exist in MaaS are removed from the database.
+* Complete machine details are cached as well, for `mjt_get_machine`.
+* Scripts that change machines in MaaS update the database themselves
+  (see `patch_machines()`), so a refresh is not needed after them.
+* The cached MaaS API description is downloaded again if the version of
+  the MaaS server has changed. Use "--reset-api" to force this.
 """
 
+import argparse
+import hashlib
+import json
+
+import peewee
+
 from maasjuju_toolkit.config import Config
+from maasjuju_toolkit.client import (
+    session, MaaSError, check_api_description, reset_api_description)
 from maasjuju_toolkit.util import (
-    session, MaaSError, db, MaaSCache, exit_with_error)
+    db, MaaSCache, VirtualMachine, chunks, exit_with_error, store_machines,
+    store_virtual_machines, delete_machines, store_machine_documents)
 
 
 def is_virtual_machine(power_parameters):
@@ -37,21 +56,81 @@ def is_virtual_machine(power_parameters):
             or any(x in address for x in ['virsh', 'ssh', 'qemu']))
 
 
-def refresh_db():
-    """gets data from server and update cache"""
-    print('Getting information from MaaS.')
+def machine_fields(machine):
+    """returns the database fields for a MaaS @machine, except for power
+    parameters. Raises KeyError if any information is missing"""
+    return dict(
+        fqdn=machine['fqdn'],
+        domain=machine['domain']['name'],
+        hostname=machine['hostname'],
+        system_id=machine['system_id'],
+        ip_addresses=', '.join(machine['ip_addresses']),
+        cpus=machine['cpu_count'],
+        ram=machine['memory'] // 1024,
+        tags=','.join(machine['tag_names'])
+    )
 
-    # Retrieves list of machines
-    try:
-        s = session()
-        machines = s.Machines.read()
-        powers = s.Machines.power_parameters()
 
-    except MaaSError as e:
-        exit_with_error('Could not GET machines: {}'.format(e))
+def machine_fingerprint(machine):
+    """returns a hash of the machine data that we keep in the database.
+    Raises KeyError if any information is missing"""
+    data = machine_fields(machine)
+    return hashlib.sha1(
+        json.dumps(data, sort_keys=True).encode()).hexdigest()
 
-    # Updates database info
-    new_data = []
+
+def changed_machines(machines):
+    """returns the @machines that changed since the last refresh"""
+    known = {
+        r.system_id: r.fingerprint for r in
+        MaaSCache.select(MaaSCache.system_id, MaaSCache.fingerprint)
+    }
+    known.update(
+        (r.system_id, r.fingerprint) for r in
+        VirtualMachine.select(VirtualMachine.system_id,
+                              VirtualMachine.fingerprint)
+    )
+
+    changed = []
+    for m in machines:
+        try:
+            if known.get(m.get('system_id')) == machine_fingerprint(m):
+                continue
+        except KeyError:
+            # let update_db() report the missing information
+            pass
+
+        changed.append(m)
+
+    return changed
+
+
+def machine_row(machine, power):
+    """returns database fields for a MaaS @machine, with power parameters
+    @power. Raises KeyError if any information is missing"""
+    return dict(
+        power_address=power.get('power_address', ''),
+        power_user=power.get('power_user', ''),
+        power_pass=power.get('power_pass', ''),
+        fingerprint=machine_fingerprint(machine),
+        **machine_fields(machine)
+    )
+
+
+def read_power_parameters(s, system_ids):
+    """returns power parameters of @system_ids, using MaaS session @s.
+    Machines are requested in chunks, to keep request URLs short"""
+    powers = {}
+    for chunk in chunks(system_ids, 100):
+        powers.update(s.Machines.power_parameters(id=chunk))
+
+    return powers
+
+
+def update_db(machines, powers, all_ids):
+    """stores @machines in the database, using power parameters from
+    @powers. Machines not in @all_ids are removed"""
+    new_data, virtual = [], []
     for m in machines:
         try:
             system_id = m.get('system_id', 'UNKNOWN')
@@ -60,36 +139,135 @@ def refresh_db():
             if is_virtual_machine(m_power):
                 print('[{}] [{}] [INFO] Skipping, virtual machine'.format(
                     system_id, m.get('hostname')))
+                virtual.append(dict(
+                    system_id=system_id, fingerprint=machine_fingerprint(m)))
                 continue
 
-            new_data.append(dict(
-                power_address=m_power.get('power_address', ''),
-                power_user=m_power.get('power_user', ''),
-                power_pass=m_power.get('power_pass', ''),
-
-                fqdn=m['fqdn'],
-                domain=m['domain']['name'],
-                hostname=m['hostname'],
-                system_id=system_id,
-                ip_addresses=', '.join(m['ip_addresses']),
-                cpus=m['cpu_count'],
-                ram=m['memory'] // 1024,
-                tags=','.join(m['tag_names'])
-            ))
+            new_data.append(machine_row(m, m_power))
 
         except KeyError as e:
             print('[{}] [ERROR] Missing information: {}'.format(system_id, e))
 
-    # Adds new data to the database
+    # Adds new data to the database, removes machines that no longer exist
     print('Updating the database: "{}"'.format(Config.sqlite_db))
-    MaaSCache.insert(new_data).on_conflict_replace().execute()
-    db.commit()
+    with db.atomic():
+        store_machines(new_data)
+        store_virtual_machines(virtual)
+
+        stale = [
+            r.system_id for model in [MaaSCache, VirtualMachine]
+            for r in model.select(model.system_id)
+            if r.system_id not in all_ids
+        ]
+        delete_machines(stale)
+
+    print('Done. Updated {} machines, removed {}.'.format(
+        len(new_data), len(stale)))
+
+
+def patch_machines(machines):
+    """updates the database with @machines, as returned by MaaS after a
+    change. Power parameters are kept from the database, and machines
+    that are not in the database are ignored"""
+    ids = [m.get('system_id') for m in machines]
+    known = {}
+    for chunk in peewee.chunked(ids, 100):
+        for r in MaaSCache.select().where(MaaSCache.system_id.in_(chunk)):
+            known[r.system_id] = r
+
+    new_data = []
+    for m in machines:
+        old = known.get(m.get('system_id'))
+        if old is None:
+            continue
+
+        power = dict(
+            power_address=old.power_address,
+            power_user=old.power_user,
+            power_pass=old.power_pass
+        )
+        try:
+            new_data.append(machine_row(m, power))
+        except KeyError as e:
+            print('[{}] [ERROR] Missing information: {}'.format(
+                old.system_id, e))
+
+    if new_data:
+        store_machines(new_data)
 
-    print('Done.')
+    store_machine_documents(machines)
+
+
+def reread_machines(system_ids):
+    """reads machines @system_ids from MaaS and updates the database. Used
+    after changes where MaaS does not return the changed machines"""
+    try:
+        machines = []
+        for chunk in chunks(system_ids, 100):
+            machines.extend(session().Machines.read(id=chunk))
+
+    except MaaSError as e:
+        print('[WARN] Could not update the database: {}'.format(e))
+        print('Refresh machine list with "mjt_refresh".')
+        return
+
+    patch_machines(machines)
+
+
+def refresh_db(incremental=False, reset_api=False):
+    """gets data from server and update cache. If @incremental is set,
+    only machines that changed since the last refresh are updated"""
+    if reset_api:
+        reset_api_description()
+    else:
+        check_api_description()
+
+    print('Getting information from MaaS.')
+
+    # Retrieves list of machines
+    try:
+        s = session()
+        machines = s.Machines.read()
+        all_ids = {m.get('system_id') for m in machines}
+
+        if incremental:
+            machines = changed_machines(machines)
+
+            # only ask for power parameters of changed machines
+            changed = [m['system_id'] for m in machines]
+            powers = read_power_parameters(s, changed)
+
+        else:
+            powers = s.Machines.power_parameters()
+
+    except MaaSError as e:
+        exit_with_error('Could not GET machines: {}'.format(e))
+
+    # complete machine details, for mjt_get_machine
+    store_machine_documents(machines)
+    update_db(machines, powers, all_ids)
 
 
 def main():
-    refresh_db()
+    """parses arguments and does work"""
+    parser = argparse.ArgumentParser(
+        description='Refresh local database of MaaS machines'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        default=False,
+        help='Only update machines that changed since the last refresh'
+    )
+    parser.add_argument(
+        '--reset-api',
+        action='store_true',
+        default=False,
+        help='Download the MaaS API description again'
+    )
+
+    args = parser.parse_args()
+    refresh_db(incremental=args.incremental, reset_api=args.reset_api)
 
 
 if __name__ == '__main__':
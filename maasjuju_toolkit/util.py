@@ -15,15 +15,28 @@
 
 """
 Author: Aggelos Kolaitis <akolaitis@admin.grnet.gr>
-Last Update: 2019/10/17
+Last Update: 2026/10/17
 Description: Common utility functions for all scripts
+
+# Notes:
+* This module is imported by all scripts, keep it cheap to import. The MaaS
+  API client lives in `client.py`, and is only imported by scripts that
+  talk to MaaS. Database tables are created on first use.
 """
 
 from datetime import datetime
+from fnmatch import fnmatchcase
+from functools import lru_cache
+from itertools import islice
+import json
+import os
+import socket
 import sys
+import threading
+import time
+from zlib import crc32
 
 import peewee
-from maas.client.bones import SessionAPI, CallError, helpers
 
 from maasjuju_toolkit.config import Config
 
@@ -31,8 +44,22 @@ from maasjuju_toolkit.config import Config
 ##################################################################
 # DATABASE
 
+
+class Database(peewee.SqliteDatabase):
+    """SQLite database. Tables are created when connecting for the first
+    time, or after the schema has changed"""
+
+    def _initialize_connection(self, conn):
+        super()._initialize_connection(conn)
+
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != schema_version():
+            create_tables()
+            conn.execute('PRAGMA user_version = {}'.format(schema_version()))
+
+
 # SQLite database
-db = peewee.SqliteDatabase(Config.sqlite_db)
+db = Database(Config.sqlite_db)
 
 
 class MaaSCache(peewee.Model):
@@ -58,9 +85,275 @@ class MaaSCache(peewee.Model):
     ram = peewee.IntegerField()
     tags = peewee.CharField(max_length=100)
 
+    # hash of the MaaS machine data, used by incremental refreshes
+    fingerprint = peewee.CharField(max_length=40, default='')
+
+
+class MachineTag(peewee.Model):
+    """machine tags, one row per tag. Used for indexed lookups"""
+
+    class Meta:
+        database = db
+        indexes = (
+            (('tag', 'system_id'), True),
+        )
+
+    system_id = peewee.CharField(max_length=20, null=False, index=True)
+    tag = peewee.CharField(max_length=100, null=False)
+
+
+class MachineIP(peewee.Model):
+    """machine IP addresses, one row per address. Used for indexed
+    lookups"""
+
+    class Meta:
+        database = db
+        indexes = (
+            (('ip_address', 'system_id'), True),
+        )
+
+    system_id = peewee.CharField(max_length=20, null=False, index=True)
+    ip_address = peewee.CharField(max_length=45, null=False)
+
+
+class VirtualMachine(peewee.Model):
+    """virtual machines are not cached, but their fingerprints are kept
+    so that `mjt_refresh --incremental` can skip them"""
+
+    class Meta:
+        database = db
+
+    system_id = peewee.CharField(unique=True, max_length=20, null=False)
+    fingerprint = peewee.CharField(max_length=40, null=False)
+
+
+class CacheInfo(peewee.Model):
+    """miscellaneous information about the cached data"""
+
+    class Meta:
+        database = db
+
+    name = peewee.CharField(unique=True, max_length=50, null=False)
+    value = peewee.IntegerField(null=False, default=0)
+
+
+class APIDescription(peewee.Model):
+    """cached MaaS API description documents, see `client.py`"""
+
+    class Meta:
+        database = db
+
+    timestamp = peewee.DateTimeField(null=False, default=datetime.now)
+
+    url = peewee.CharField(unique=True, max_length=200, null=False)
+    version = peewee.CharField(max_length=50, null=False)
+    description = peewee.TextField(null=False)  # as JSON
+
+
+class ScriptResultsCache(peewee.Model):
+    """summary of machine script results, see `get_script_results()`"""
+
+    class Meta:
+        database = db
+
+    timestamp = peewee.DateTimeField(null=False, default=datetime.now)
+
+    system_id = peewee.CharField(unique=True, max_length=20, null=False)
+    results = peewee.TextField(null=False)  # as JSON
+
+
+class MachineDocument(peewee.Model):
+    """complete machine information as returned by MaaS, see
+    `mjt_get_machine`"""
+
+    class Meta:
+        database = db
+
+    timestamp = peewee.DateTimeField(null=False, default=datetime.now)
+
+    system_id = peewee.CharField(unique=True, max_length=20, null=False)
+    document = peewee.TextField(null=False)  # as JSON
+
+
+class NagiosFragment(peewee.Model):
+    """rendered Nagios configuration of a Juju machine, see
+    `mjt_juju_nagios_deps --incremental`"""
+
+    class Meta:
+        database = db
+
+    timestamp = peewee.DateTimeField(null=False, default=datetime.now)
+
+    key = peewee.CharField(unique=True, max_length=300, null=False)
+    fingerprint = peewee.CharField(max_length=40, null=False)
+    fragment = peewee.TextField(null=False, default='')
+
+
+class SelEvent(peewee.Model):
+    """IPMI system event log records, see `mjt_ipmi_sel collect`"""
+
+    class Meta:
+        database = db
+        indexes = (
+            (('system_id', 'record_id'), False),
+        )
+
+    collected = peewee.DateTimeField(null=False, default=datetime.now)
+
+    system_id = peewee.CharField(max_length=20, null=False)
+    record_id = peewee.IntegerField(null=False)
+    timestamp = peewee.DateTimeField(null=True, index=True)
+    name = peewee.CharField(max_length=100)
+    type = peewee.CharField(max_length=100, index=True)
+    event = peewee.TextField()
+
+
+class SelState(peewee.Model):
+    """last IPMI system event log record collected for each machine"""
+
+    class Meta:
+        database = db
+
+    timestamp = peewee.DateTimeField(null=False, default=datetime.now)
+
+    system_id = peewee.CharField(unique=True, max_length=20, null=False)
+    last_record_id = peewee.IntegerField(null=False, default=0)
+
+
+class DomainUpdate(peewee.Model):
+    """outcome of the last domain update of each machine, see
+    `mjt_update_domain_name`. @error is empty on success"""
+
+    class Meta:
+        database = db
+        indexes = (
+            (('domain', 'system_id'), True),
+        )
+
+    timestamp = peewee.DateTimeField(null=False, default=datetime.now)
+
+    system_id = peewee.CharField(max_length=20, null=False)
+    domain = peewee.CharField(max_length=30, null=False)
+    error = peewee.TextField(null=False, default='')
+
+
+MODELS = [MaaSCache, MachineTag, MachineIP, VirtualMachine, CacheInfo,
+          APIDescription, ScriptResultsCache, MachineDocument,
+          NagiosFragment, SelEvent, SelState, DomainUpdate]
+
+
+def schema_version():
+    """returns a checksum of the database schema"""
+    schema = ';'.join(
+        '{}:{}'.format(m._meta.table_name, ','.join(sorted(m._meta.columns)))
+        for m in MODELS)
+
+    return crc32(schema.encode()) & 0x7fffffff
+
+
+def create_tables():
+    """creates database tables. The database is only a cache, so tables
+    with an outdated schema are dropped and created again"""
+    created = set()
+    for model in MODELS:
+        table = model._meta.table_name
+        if model.table_exists():
+            columns = {c.name for c in db.get_columns(table)}
+            if columns == set(model._meta.columns):
+                continue
+
+            print('[WARN] Schema of table "{}" changed, run mjt_refresh'
+                  .format(table), file=sys.stderr)
+            model.drop_table()
 
-# auto create table
-MaaSCache.create_table()
+        model.create_table()
+        created.add(model)
+
+    # build missing lookup tables from existing machines
+    if {MachineTag, MachineIP} & created:
+        with db.atomic():
+            MachineTag.delete().execute()
+            MachineIP.delete().execute()
+            _index_machines(MaaSCache.select().dicts())
+
+
+def _index_machines(rows):
+    """adds tags and IP addresses of machine @rows (dicts of MaaSCache
+    fields) to the lookup tables"""
+    tags, ips = [], []
+    for row in rows:
+        tags.extend(
+            dict(system_id=row['system_id'], tag=t)
+            for t in set(row['tags'].split(',')) if t)
+        ips.extend(
+            dict(system_id=row['system_id'], ip_address=ip)
+            for ip in set(row['ip_addresses'].split(', ')) if ip)
+
+    for chunk in peewee.chunked(tags, 100):
+        MachineTag.insert_many(chunk).execute()
+    for chunk in peewee.chunked(ips, 100):
+        MachineIP.insert_many(chunk).execute()
+
+
+def cache_generation():
+    """returns the generation of the machine cache. This changes every
+    time machines are stored or deleted"""
+    row = CacheInfo.get_or_none(CacheInfo.name == 'generation')
+    return row.value if row else 0
+
+
+def _next_generation():
+    """increases the generation of the machine cache"""
+    updated = CacheInfo.update(value=CacheInfo.value + 1).where(
+        CacheInfo.name == 'generation').execute()
+    if not updated:
+        CacheInfo.insert(name='generation', value=1).execute()
+
+
+def delete_machines(system_ids):
+    """removes machines from the database"""
+    with db.atomic():
+        for ids in peewee.chunked(system_ids, 100):
+            for model in [MaaSCache, MachineTag, MachineIP, VirtualMachine]:
+                model.delete().where(model.system_id.in_(ids)).execute()
+
+        _next_generation()
+
+
+def store_machines(rows):
+    """inserts or replaces machine @rows (dicts of MaaSCache fields)
+    in the database"""
+    with db.atomic():
+        for chunk in peewee.chunked(rows, 100):
+            ids = [row['system_id'] for row in chunk]
+            MachineTag.delete().where(MachineTag.system_id.in_(ids)).execute()
+            MachineIP.delete().where(MachineIP.system_id.in_(ids)).execute()
+
+            MaaSCache.insert_many(chunk).on_conflict_replace().execute()
+            _index_machines(chunk)
+
+        _next_generation()
+
+
+def store_virtual_machines(rows):
+    """inserts or replaces virtual machine @rows (dicts of VirtualMachine
+    fields) in the database"""
+    with db.atomic():
+        for chunk in peewee.chunked(rows, 100):
+            VirtualMachine.insert_many(chunk).on_conflict_replace().execute()
+
+
+def store_machine_documents(machines):
+    """caches @machines, as returned by MaaS"""
+    now = datetime.now()
+    rows = [
+        dict(timestamp=now, system_id=m['system_id'], document=json.dumps(m))
+        for m in machines if 'system_id' in m
+    ]
+
+    with db.atomic():
+        for chunk in peewee.chunked(rows, 100):
+            MachineDocument.insert_many(chunk).on_conflict_replace().execute()
 
 
 ##################################################################
@@ -72,48 +365,252 @@ def exit_with_error(msg, code=3):
     sys.exit(code)
 
 
-def print_nagios(output):
-    """prints results for nagios. @output must be a `{
-        'ok': [list of ok message],
-        'warning': [list of warning messages],
-        'critical': [list of critical messages]
-    }`"""
+def format_nagios(output, perfdata=None):
+    """returns the text and exit code for nagios. See `print_nagios()`"""
+
+    perf = ''
+    if perfdata:
+        perf = ' | ' + ' '.join(
+            '{}={}'.format(k, v) for k, v in perfdata.items())
 
     if not output['warning'] and not output['critical']:
-        print('OK')
-        sys.exit(0)
+        return 'OK' + perf, 0
 
     msgs = output['critical'] + output['warning']
     header, exitcode = 'WARNING:', 1
     if output['critical']:
         header, exitcode = 'CRITICAL:', 2
 
-    print(header, ', '.join(msgs))
+    return '{} {}{}'.format(header, ', '.join(msgs), perf), exitcode
+
+
+def print_nagios(output, perfdata=None):
+    """prints results for nagios. @output must be a `{
+        'ok': [list of ok message],
+        'warning': [list of warning messages],
+        'critical': [list of critical messages]
+    }`. @perfdata is an optional `{'label': 'value'}` dict"""
+
+    text, exitcode = format_nagios(output, perfdata)
+    print(text)
     sys.exit(exitcode)
 
 
-# Collection of errors that may happen when using MaaS API
-MaaSError = (CallError, helpers.RemoteError)
+def write_atomic(path, chunks):
+    """writes the strings of iterable @chunks to file @path. The file is
+    first written under a temporary name and then renamed, so readers
+    never see a partially written file. On error, @path is left intact"""
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp, 'w') as fout:
+            for chunk in chunks:
+                fout.write(chunk)
+
+            fout.flush()
+            os.fsync(fout.fileno())
+
+        if os.path.exists(path):
+            os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+
+        os.replace(tmp, path)
+
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def print_ndjson(record):
+    """prints @record as a single line of JSON (newline delimited JSON),
+    so that readers can process records as soon as they are printed"""
+    print(json.dumps(record), flush=True)
+
+
+def daemon_call(method, **params):
+    """calls @method of the mjt daemon (see `daemon.py`) with @params.
+    Returns None if the daemon is not running or could not answer, in
+    which case the caller should do the work itself"""
+    if not Config.daemon_socket or not os.path.exists(Config.daemon_socket):
+        return None
+
+    request = json.dumps({'method': method, 'params': params})
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(Config.daemon_timeout)
+            sock.connect(Config.daemon_socket)
+            sock.sendall(request.encode() + b'\n')
+            sock.shutdown(socket.SHUT_WR)
+
+            data = b''
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+
+        return json.loads(data.decode()).get('result')
+
+    except (OSError, ValueError):
+        return None
+
+
+def is_maas_error(error):
+    """returns True if @error is an error of the MaaS API client. The
+    client is only imported if needed"""
+    if 'maasjuju_toolkit.client' not in sys.modules:
+        return False
+
+    from maasjuju_toolkit.client import MaaSError
+    return isinstance(error, MaaSError)
+
 
+def ensure_event_loop():
+    """MaaS client calls block on the event loop of the current thread.
+    Threads other than the main one must call this before using it.
+    Returns the new event loop, if one was created. The caller should
+    close it once the thread is done"""
+    import asyncio
 
-__session = None
+    try:
+        asyncio.get_event_loop()
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        return loop
+
+    return None
+
+
+def _call_in_thread(func, item, loops):
+    """calls func(item) from a worker thread. New event loops are added
+    to @loops"""
+    loop = ensure_event_loop()
+    if loop is not None:
+        loops.append(loop)
+
+    return func(item)
+
+
+# Seconds to wait before retrying a failed request, doubles on each retry
+RETRY_BACKOFF = 1
+
+
+def is_transient(error):
+    """returns True if a MaaS error is worth retrying (server errors,
+    throttling and connection errors)"""
+    status = getattr(error, 'status', None)
+    return status is None or status >= 500 or status == 429
+
+
+class RateLimiter:
+    """limits the rate of calls to wait() to @rate per second, across all
+    threads. A @rate of 0 means no limit"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_call = 0
+        self.lock = threading.Lock()
 
+    def wait(self):
+        if not self.interval:
+            return
 
-def session():
-    """opens a new session to the MaaS server. subsequent calls return the
-    same session"""
-    global __session
-    if __session:
-        return __session
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
 
+        if delay > 0:
+            time.sleep(delay)
+
+
+def run_parallel(func, items, jobs=None, rate=None, retries=0):
+    """calls func(item) for each of @items, using up to @jobs concurrent
+    threads, at most @rate calls per second. Calls that fail with a
+    transient MaaS error are retried up to @retries times, with
+    exponential backoff. Yields `(item, result, error)` tuples as soon as
+    each call completes. MaaS errors are returned as `error`, so that a
+    failure for one item does not affect the others"""
+    if jobs is None:
+        jobs = Config.jobs
+
+    limiter = RateLimiter(rate)
+
+    def call(item):
+        for attempt in range(retries + 1):
+            limiter.wait()
+            try:
+                return func(item)
+            except Exception as e:
+                if (attempt == retries or not is_maas_error(e)
+                        or not is_transient(e)):
+                    raise
+
+                time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+    if jobs <= 1:
+        for item in items:
+            try:
+                yield item, call(item), None
+            except Exception as e:
+                if not is_maas_error(e):
+                    raise
+
+                yield item, None, e
+
+        return
+
+    from concurrent.futures import (
+        FIRST_COMPLETED, ThreadPoolExecutor, wait)
+
+    items = iter(items)
+    loops = []
     try:
-        _, __session = SessionAPI.connect(
-            Config.maas_api_url, apikey=Config.maas_api_key)
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            # only a few calls are submitted ahead of the caller, so that
+            # results are not kept in memory until it gets to them
+            pending = {}
+            while True:
+                for item in islice(items, 2 * jobs - len(pending)):
+                    future = executor.submit(
+                        _call_in_thread, call, item, loops)
+                    pending[future] = item
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    try:
+                        result, error = future.result(), None
+                    except Exception as e:
+                        if not is_maas_error(e):
+                            raise
 
-        return __session
+                        result, error = None, e
 
-    except MaaSError as e:
-        exit_with_error('Could not connect to MaaS: {}'.format(e))
+                    yield item, result, error
+
+    finally:
+        # worker threads are gone, close their event loops
+        for loop in loops:
+            loop.close()
+
+
+def chunks(items, size):
+    """splits @items into lists of at most @size items"""
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def print_summary(succeeded, failed, started):
+    """prints a summary for a bulk operation that started at @started
+    (as returned by time.monotonic())"""
+    elapsed = time.monotonic() - started
+    total = succeeded + failed
+    print('Done. {} succeeded, {} failed, {:.1f}s ({:.1f} ops/s)'.format(
+        succeeded, failed, elapsed, total / elapsed if elapsed else 0))
 
 
 def query_machines(machine_filters):
@@ -127,27 +624,85 @@ def query_machines(machine_filters):
         exit_with_error('Programming error: query_machines() requires a list')
 
     if machine_filters:
-        # search fqdn, system id
+        # search fqdn, system id, domain, hostname, ip address
+
+        by_ip = MachineIP.select(MachineIP.system_id).where(
+            MachineIP.ip_address.in_(machine_filters))
 
         filters = (MaaSCache.fqdn.in_(machine_filters)
                    | MaaSCache.system_id.in_(machine_filters)
-                   | MaaSCache.ip_addresses.contains(machine_filters)
+                   | MaaSCache.system_id.in_(by_ip)
                    | MaaSCache.domain.in_(machine_filters)
                    | MaaSCache.hostname.in_(machine_filters))
 
+        # search with tags. comma separated == AND
+        single_tags = []
+        for name in machine_filters:
+            tags = {t for t in name.split(',') if t}
+            if len(tags) <= 1:
+                single_tags.extend(tags)
+                continue
+
+            filters |= MaaSCache.system_id.in_(
+                MachineTag.select(MachineTag.system_id)
+                .where(MachineTag.tag.in_(list(tags)))
+                .group_by(MachineTag.system_id)
+                .having(peewee.fn.COUNT(MachineTag.tag) == len(tags)))
+
+        filters |= MaaSCache.system_id.in_(
+            MachineTag.select(MachineTag.system_id)
+            .where(MachineTag.tag.in_(single_tags)))
+
+        # search using regex in hostname
         for name in machine_filters:
-            sp = name.split(',')
-
-            tag_filter = MaaSCache.tags.contains(sp[0])
-            for tag in sp[1:]:
-                tag_filter &= MaaSCache.tags.contains(tag)
-
-            # search with tags. comma separated == AND
-            filters |= tag_filter
-
-            # search using regex in hostname
             filters |= MaaSCache.hostname % name
 
         rows = rows.where(filters)
 
     return rows
+
+
+def machine_matches(row, machine_filter):
+    """returns True if MaaSCache @row matches @machine_filter. Uses the
+    same rules as `query_machines()`, for filtering rows in memory"""
+    if machine_filter in (row.fqdn, row.system_id, row.domain, row.hostname):
+        return True
+
+    if machine_filter in row.ip_addresses.split(', '):
+        return True
+
+    # comma separated tags == AND
+    tags = {t for t in machine_filter.split(',') if t}
+    if tags and tags.issubset(row.tags.split(',')):
+        return True
+
+    # same as the GLOB of the hostname in SQLite
+    return fnmatchcase(row.hostname, machine_filter)
+
+
+@lru_cache(maxsize=256)
+def _query_plan(machine_filters):
+    """returns the SQL query and parameters for @machine_filters (a
+    normalized tuple). See `query_machines()`"""
+    return query_machines(list(machine_filters)).sql()
+
+
+@lru_cache(maxsize=256)
+def _resolve(generation, machine_filters):
+    """runs the query plan for @machine_filters. @generation is only
+    used as part of the cache key"""
+    sql, params = _query_plan(machine_filters)
+    return tuple(MaaSCache.raw(sql, *params))
+
+
+def resolve_machines(machine_filters):
+    """same as `query_machines()`, but returns a list of machines.
+    Results are kept in memory, until the machine cache changes.
+    Prefer this over `query_machines()`, unless a query is needed"""
+
+    if not isinstance(machine_filters, list):
+        exit_with_error(
+            'Programming error: resolve_machines() requires a list')
+
+    return list(_resolve(
+        cache_generation(), tuple(sorted(set(machine_filters)))))
@@ -0,0 +1,72 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Tests for the incremental JSON reader of `mjt_juju_nagios_deps`
+
+# Usage:
+$ python -m unittest discover tests
+"""
+
+import io
+import unittest
+
+from maasjuju_toolkit.juju.nagios_deps import JSONReader
+
+
+def read_machines(document, chunk_size):
+    """reads the machines of a Juju status @document with a JSONReader,
+    using chunks of @chunk_size characters"""
+    reader = JSONReader(io.StringIO(document), chunk_size)
+    machines = {}
+    for key in reader.keys():
+        if key != 'machines':
+            reader.value()
+            continue
+
+        for name in reader.keys():
+            machines[name] = reader.value()
+
+    return machines
+
+
+class TestJSONReader(unittest.TestCase):
+
+    def test_chunk_boundaries(self):
+        document = (
+            '{"model": {"name": "x"}, "machines": {"0": 0.1, "1": 2, '
+            '"2": 1.5e+3, "3": -12, "4": [1.25, true], "5": {"a": null}}}'
+        )
+        expected = {
+            '0': 0.1, '1': 2, '2': 1500.0, '3': -12, '4': [1.25, True],
+            '5': {'a': None}
+        }
+
+        for chunk_size in range(1, len(document) + 1):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(
+                    read_machines(document, chunk_size), expected)
+
+    def test_number_at_end_of_file(self):
+        reader = JSONReader(io.StringIO('12.5'), 1)
+        self.assertEqual(reader.value(), 12.5)
+
+    def test_truncated_document(self):
+        with self.assertRaises(ValueError):
+            read_machines('{"machines": {"0": {"a": 1', 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
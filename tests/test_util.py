@@ -0,0 +1,83 @@
+# Copyright (C) 2019  GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Tests for the machine lookup of `util.query_machines()`, using a
+temporary database
+
+# Usage:
+$ python -m unittest discover tests
+"""
+
+import os
+import tempfile
+import unittest
+
+from maasjuju_toolkit.util import db, query_machines, store_machines
+
+
+def machine(system_id, hostname, ip_addresses, tags):
+    """returns MaaSCache fields for a test machine"""
+    return dict(
+        system_id=system_id, hostname=hostname, domain='maas',
+        fqdn='{}.maas'.format(hostname), ip_addresses=', '.join(ip_addresses),
+        cpus=4, ram=8, tags=','.join(tags))
+
+
+class TestQueryMachines(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        db.init(os.path.join(self.tmpdir.name, 'test.db'))
+
+        store_machines([
+            machine('aaa', 'node1', ['10.0.0.1'], ['gpu', 'rack1']),
+            machine('bbb', 'node2', ['10.0.0.10', '10.1.0.1'], ['gpu-old']),
+            machine('ccc', 'node3', ['10.0.0.100'], ['rack1']),
+        ])
+
+    def tearDown(self):
+        db.close()
+        self.tmpdir.cleanup()
+
+    def query(self, *machine_filters):
+        return sorted(r.system_id for r in query_machines(
+            list(machine_filters)))
+
+    def test_exact_tag(self):
+        self.assertEqual(self.query('gpu'), ['aaa'])
+        self.assertEqual(self.query('gpu-old'), ['bbb'])
+        self.assertEqual(self.query('gp'), [])
+
+    def test_all_tags(self):
+        self.assertEqual(self.query('gpu,rack1'), ['aaa'])
+        self.assertEqual(self.query('gpu-old,rack1'), [])
+
+    def test_exact_ip_address(self):
+        self.assertEqual(self.query('10.0.0.1'), ['aaa'])
+        self.assertEqual(self.query('10.0.0.10'), ['bbb'])
+        self.assertEqual(self.query('10.1.0.1'), ['bbb'])
+        self.assertEqual(self.query('10.0.0'), [])
+
+    def test_filters_are_ored(self):
+        self.assertEqual(self.query('gpu', '10.0.0.100'), ['aaa', 'ccc'])
+        self.assertEqual(self.query('node2', 'rack1'), ['aaa', 'bbb', 'ccc'])
+
+    def test_no_filters(self):
+        self.assertEqual(self.query(), ['aaa', 'bbb', 'ccc'])
+
+
+if __name__ == '__main__':
+    unittest.main()